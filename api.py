@@ -1,13 +1,51 @@
-from zeep import Client, Settings, xsd
-from dataclasses import dataclass, replace
+from zeep import AsyncClient, Client, Settings, Transport, xsd
+from zeep.cache import SqliteCache
+from zeep.exceptions import Fault, TransportError
+from zeep.helpers import serialize_object
+from zeep.proxy import AsyncServiceProxy, ServiceProxy
+from zeep.transports import AsyncTransport
+from zeep.wsdl import Document
+from dataclasses import dataclass, field, replace
 from enum import StrEnum, IntEnum
 from xml.dom.minidom import parseString
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, time as time_type
+from decimal import Decimal
+from functools import partial
+from types import SimpleNamespace
+from array import array
+from collections.abc import MutableSequence, Sequence
+from requests.adapters import HTTPAdapter
+
+import httpx
+import numpy as np
+import requests
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
 
 import xml.etree.ElementTree as ET # noqa
+import asyncio
+import csv
+import hashlib
 import json
 import math
+import mmap
 import os
+import random
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
 
 class Tag(StrEnum):
     UNKNOWN = "Unknown"
@@ -90,6 +128,11 @@ class Tag(StrEnum):
         else:
             return cls.UNKNOWN
 
+    @classmethod
+    def tag_ids(cls, tags: list["Tag"]):
+        # the radio reference tag ids that convert to any of tags
+        return [tag_id for tag_id in range(1, 38) if cls.convert_tag(tag_id) in tags]
+
     def serialize(self):
         return {
             "name": self.name,
@@ -180,6 +223,10 @@ class Mode(IntEnum):
     def deserialize(cls, tag: dict):
         return cls[tag["name"]]
 
+def _intern(name):
+    # names repeat heavily across talkgroups, sites and agencies, keep one copy of each
+    return sys.intern(name) if type(name) is str else name
+
 class Systems(list):
     def serialize(self):
         systems = []
@@ -205,6 +252,12 @@ class Systems(list):
             systems = json.load(f)
         return cls.deserialize(systems)
 
+    @staticmethod
+    def iter_file(filename: str, predicate=None):
+        for system in JSONStream.iter_file(filename):
+            if predicate is None or predicate(system):
+                yield System.deserialize(system)
+
 class Sites(list):
     def serialize(self):
         sites = []
@@ -219,21 +272,97 @@ class Sites(list):
             self.append(Site.deserialize(site))
         return self
 
-class Talkgroups(list):
+class Talkgroups(MutableSequence):
+    # ids and tags live in typed arrays, items are rebuilt as Talkgroup views on access,
+    # so changes to a view have to be stored back with talkgroups[i] = talkgroup. views are
+    # copies, anything still holding one (query results included) won't see later changes
+    __slots__ = ("ids", "names", "tags")
+
+    TAGS = tuple(Tag)
+    CODES = {tag: code for code, tag in enumerate(TAGS)}
+
+    def __init__(self, talkgroups=()):
+        self.ids = array("q")
+        self.names = []
+        self.tags = array("B")
+        self.extend(talkgroups)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            talkgroups = Talkgroups()
+            talkgroups.ids = self.ids[i]
+            talkgroups.names = self.names[i]
+            talkgroups.tags = self.tags[i]
+            return talkgroups
+        return Talkgroup(self.ids[i], self.names[i], self.TAGS[self.tags[i]])
+
+    def __setitem__(self, i, talkgroup):
+        if isinstance(i, slice):
+            talkgroups = Talkgroups(talkgroup)
+            self.ids[i] = talkgroups.ids
+            self.names[i] = talkgroups.names
+            self.tags[i] = talkgroups.tags
+            return
+        self.ids[i] = talkgroup.tg_id
+        self.names[i] = _intern(talkgroup.tg_name)
+        self.tags[i] = self.CODES[talkgroup.tg_tag]
+
+    def __delitem__(self, i):
+        del self.ids[i]
+        del self.names[i]
+        del self.tags[i]
+
+    def __iter__(self):
+        for tg_id, tg_name, code in zip(self.ids, self.names, self.tags):
+            yield Talkgroup(tg_id, tg_name, self.TAGS[code])
+
+    def __eq__(self, other):
+        if isinstance(other, Talkgroups):
+            return self.ids == other.ids and self.tags == other.tags and self.names == other.names
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Talkgroups({list(self)!r})"
+
+    def insert(self, i, talkgroup):
+        self.ids.insert(i, talkgroup.tg_id)
+        self.names.insert(i, _intern(talkgroup.tg_name))
+        self.tags.insert(i, self.CODES[talkgroup.tg_tag])
+
+    def append(self, talkgroup):
+        self.ids.append(talkgroup.tg_id)
+        self.names.append(_intern(talkgroup.tg_name))
+        self.tags.append(self.CODES[talkgroup.tg_tag])
+
+    def extend(self, talkgroups):
+        for talkgroup in talkgroups:
+            self.append(talkgroup)
+
     def serialize(self):
         talkgroups = []
-        for talkgroup in self:
-            talkgroups.append(talkgroup.serialize())
+        for tg_id, tg_name, code in zip(self.ids, self.names, self.tags):
+            talkgroups.append({
+                "tg_id": tg_id,
+                "tg_name": tg_name,
+                "tg_tag": self.TAGS[code].serialize()
+            })
         return talkgroups
 
     @classmethod
     def deserialize(cls, talkgroups: list):
         self = cls()
         for talkgroup in talkgroups:
-            self.append(Talkgroup.deserialize(talkgroup))
+            self.ids.append(talkgroup["tg_id"])
+            self.names.append(_intern(talkgroup["tg_name"]))
+            self.tags.append(self.CODES[Tag.deserialize(talkgroup["tg_tag"])])
         return self
 
-@dataclass
+@dataclass(slots=True)
 class Talkgroup:
     tg_id: int
     tg_name: str
@@ -250,11 +379,11 @@ class Talkgroup:
     def deserialize(cls, talkgroup: dict):
         return cls(
             tg_id=talkgroup["tg_id"],
-            tg_name=talkgroup["tg_name"],
+            tg_name=_intern(talkgroup["tg_name"]),
             tg_tag=Tag.deserialize(talkgroup["tg_tag"])
         )
 
-@dataclass
+@dataclass(slots=True)
 class Site:
     name: str
     site_id: int
@@ -278,7 +407,7 @@ class Site:
     @classmethod
     def deserialize(cls, site: dict):
         return cls(
-            name=site["name"],
+            name=_intern(site["name"]),
             site_id=site["site_id"],
             control=site["control"],
             channels=site["channels"],
@@ -294,6 +423,7 @@ class System:
     modulation: Modulation
     talkgroups: Talkgroups
     sites: Sites
+    last_updated: str | None = None
 
     def serialize(self):
         return {
@@ -301,7 +431,8 @@ class System:
             "system_id": self.system_id,
             "modulation": self.modulation.serialize(),
             "talkgroups": self.talkgroups.serialize(),
-            "sites": self.sites.serialize()
+            "sites": self.sites.serialize(),
+            "last_updated": self.last_updated
         }
 
     @classmethod
@@ -311,10 +442,11 @@ class System:
             system_id=system["system_id"],
             modulation=Modulation.deserialize(system["modulation"]),
             talkgroups=Talkgroups.deserialize(system["talkgroups"]),
-            sites=Sites.deserialize(system["sites"])
+            sites=Sites.deserialize(system["sites"]),
+            last_updated=system.get("last_updated")
         )
 
-@dataclass
+@dataclass(slots=True)
 class Tone:
     tone_type: ToneType
     tone_value: float
@@ -332,7 +464,7 @@ class Tone:
             tone_value=tone["tone_value"]
         )
 
-@dataclass
+@dataclass(slots=True)
 class AgencyFreq:
     name: str
     tone: Tone
@@ -352,7 +484,7 @@ class AgencyFreq:
     @classmethod
     def deserialize(cls, agency_freq):
         return cls(
-            name=agency_freq["name"],
+            name=_intern(agency_freq["name"]),
             tone=Tone.deserialize(agency_freq["tone"]),
             mode=Mode.deserialize(agency_freq["mode"]),
             freq=agency_freq["freq"],
@@ -379,22 +511,28 @@ class Agency:
     county_name: str
     agency_name: str # subcat name
     freqs: AgencyFreqs[AgencyFreq]
+    parent_id: int | None = None # aid
+    last_updated: str | None = None
 
     def serialize(self):
         return {
             "agency_id": self.agency_id,
             "county_name": self.county_name,
             "agency_name": self.agency_name,
-            "freqs": self.freqs.serialize()
+            "freqs": self.freqs.serialize(),
+            "parent_id": self.parent_id,
+            "last_updated": self.last_updated
         }
 
     @classmethod
     def deserialize(cls, agency: dict):
         return cls(
             agency_id=agency["agency_id"],
-            county_name=agency["county_name"],
-            agency_name=agency["agency_name"],
-            freqs=AgencyFreqs.deserialize(agency["freqs"])
+            county_name=_intern(agency["county_name"]),
+            agency_name=_intern(agency["agency_name"]),
+            freqs=AgencyFreqs.deserialize(agency["freqs"]),
+            parent_id=agency.get("parent_id"),
+            last_updated=agency.get("last_updated")
         )
 
 class Agencies(list):
@@ -422,10 +560,520 @@ class Agencies(list):
             agencies = json.load(f)
         return cls.deserialize(agencies)
 
+    @staticmethod
+    def iter_file(filename: str, predicate=None):
+        for agency in JSONStream.iter_file(filename):
+            if predicate is None or predicate(agency):
+                yield Agency.deserialize(agency)
+
+class JSONStream:
+    WHITESPACE = " \t\n\r"
+    NUMBER = "0123456789.eE+-"
+
+    def __init__(self, f, chunk_size: int = 1 << 16, max_value_size: int = 1 << 26):
+        self.file = f
+        self.chunk_size = chunk_size
+        # characters a single value may take before the input is treated as malformed
+        self.max_value_size = max_value_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+
+    @classmethod
+    def iter_file(cls, filename: str, key: str | None = None):
+        # yields the raw items of the top level array, or of the array under key in the top level object
+        with open(filename, "r") as f:
+            stream = cls(f)
+            if key is None:
+                yield from stream.array()
+                return
+            for name in stream.object():
+                if name == key:
+                    yield from stream.array()
+                else:
+                    stream.skip()
+
+    def fill(self, size: int | None = None):
+        chunk = self.file.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # drop what has already been parsed so the buffer only ever holds about one record
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def grow(self):
+        # an incomplete value is decoded again on a buffer twice the size, so long values stay linear
+        size = len(self.buffer) - self.pos
+        if size >= self.max_value_size:
+            raise ValueError(f"JSON value at character {self.offset + self.pos} is longer than {self.max_value_size}")
+        return self.fill(max(self.chunk_size, min(size, self.max_value_size - size)))
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found or 'end of file'!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.grow():
+                    raise
+                continue
+            # a number that runs up to the end of the buffer may carry on in the next chunk, decoding
+            # stops early when the chunk ends inside its fraction or exponent
+            tail = end
+            while tail < len(self.buffer) and self.buffer[tail] in self.NUMBER:
+                tail += 1
+            if tail == len(self.buffer) and not self.eof and self.grow():
+                continue
+            self.pos = end
+            return value
+
+    def separator(self, close: str):
+        char = self.peek()
+        if char not in ("," + close):
+            raise ValueError(f"Expected ',' or {close!r} but found {char or 'end of file'!r}")
+        self.pos += 1
+        return char == close
+
+    def array(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.separator("]"):
+                return
+
+    def object(self):
+        # yields each key, the caller has to consume its value before asking for the next one
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.separator("}"):
+                return
+
+    def skip(self):
+        if self.peek() == "[":
+            for _ in self.array():
+                pass
+        else:
+            self.value()
+
+class _StreamedRecords:
+    # re-reads the file on every pass so several passes still run in constant memory
+    def __init__(self, records):
+        self.records = records
+
+    def __iter__(self):
+        return self.records()
+
+class DatabaseIndex:
+    def __init__(self, db: "Database"):
+        self.systems: dict[int, System] = {}
+        # talkgroups stay in their systems' arrays, the index only keeps (length, tg_id -> position) per
+        # system, built on the first lookup and rebuilt when the length or the id at a position changed
+        self.talkgroups: dict[int, tuple[int, dict[int, int]]] = {}
+        # tag -> system_id -> positions, talkgroup edits made in place need add_system again to show up here
+        self.talkgroup_tags: dict[Tag, dict[int, array]] = defaultdict(dict)
+        self.agencies: dict[int, Agency] = {}
+        # secondary indexes map to dicts keyed by a unique id so removals stay O(1) per entry
+        self.freq_tags: dict[Tag, dict[int, tuple[Agency, AgencyFreq]]] = defaultdict(dict)
+        self.modes: dict[Mode, dict[int, tuple[Agency, AgencyFreq]]] = defaultdict(dict)
+        self.frequencies: dict[float, dict[int, tuple[Agency, AgencyFreq]]] = defaultdict(dict)
+        self.counties: dict[str, dict[int, Agency]] = defaultdict(dict)
+
+        for system in db.systems:
+            self.add_system(system)
+        for agency in db.agencies:
+            self.add_agency(agency)
+
+    @staticmethod
+    def freq_key(freq: float):
+        return round(freq, 5)
+
+    def add_system(self, system: System):
+        self.remove_system(system.system_id)
+        self.systems[system.system_id] = system
+
+        talkgroups = system.talkgroups
+        if isinstance(talkgroups, Talkgroups):
+            codes = talkgroups.tags.tobytes()
+        else:
+            codes = bytes(Talkgroups.CODES[talkgroup.tg_tag] for talkgroup in talkgroups)
+        for code in set(codes):
+            positions = array("I")
+            i = codes.find(code)
+            while i != -1:
+                positions.append(i)
+                i = codes.find(code, i + 1)
+            self.talkgroup_tags[Talkgroups.TAGS[code]][system.system_id] = positions
+
+    def remove_system(self, system_id: int):
+        self.systems.pop(system_id, None)
+        self.talkgroups.pop(system_id, None)
+        for systems in self.talkgroup_tags.values():
+            systems.pop(system_id, None)
+
+    def add_agency(self, agency: Agency):
+        self.agencies[agency.agency_id] = agency
+        self.counties[agency.county_name][agency.agency_id] = agency
+        for freq in agency.freqs:
+            entry = (agency, freq)
+            self.freq_tags[freq.tag][id(freq)] = entry
+            self.modes[freq.mode][id(freq)] = entry
+            self.frequencies[self.freq_key(freq.freq)][id(freq)] = entry
+
+    def remove_agency(self, agency_id: int):
+        agency = self.agencies.pop(agency_id, None)
+        if agency is None:
+            return
+        self.counties[agency.county_name].pop(agency_id, None)
+        for freq in agency.freqs:
+            self.freq_tags[freq.tag].pop(id(freq), None)
+            self.modes[freq.mode].pop(id(freq), None)
+            self.frequencies[self.freq_key(freq.freq)].pop(id(freq), None)
+
+    def system(self, system_id: int):
+        return self.systems.get(system_id)
+
+    def talkgroup(self, system_id: int, tg_id: int):
+        system = self.systems.get(system_id)
+        if system is None:
+            return None
+        talkgroups = system.talkgroups
+        length, positions = self.talkgroups.get(system_id, (None, None))
+        position = positions.get(tg_id) if positions is not None else None
+        # a miss on an unchanged length is a real miss, only a stale map gets rebuilt
+        if positions is None or length != len(talkgroups) or (
+                position is not None and talkgroups[position].tg_id != tg_id):
+            if isinstance(talkgroups, Talkgroups):
+                positions = {talkgroup_id: i for i, talkgroup_id in enumerate(talkgroups.ids)}
+            else:
+                positions = {talkgroup.tg_id: i for i, talkgroup in enumerate(talkgroups)}
+            self.talkgroups[system_id] = (len(talkgroups), positions)
+            position = positions.get(tg_id)
+        if position is None:
+            return None
+        return talkgroups[position]
+
+    def agency(self, agency_id: int):
+        return self.agencies.get(agency_id)
+
+    def talkgroups_with_tag(self, tag: Tag):
+        # positions recorded by add_system, views are only built for the matches
+        results = []
+        code = Talkgroups.CODES[tag]
+        for system_id, positions in self.talkgroup_tags.get(tag, {}).items():
+            system = self.systems[system_id]
+            talkgroups = system.talkgroups
+            length = len(talkgroups)
+            if isinstance(talkgroups, Talkgroups):
+                ids, names, tags = talkgroups.ids, talkgroups.names, talkgroups.tags
+                results.extend(
+                    (system, Talkgroup(ids[i], names[i], tag)) for i in positions if i < length and tags[i] == code
+                )
+            else:
+                results.extend(
+                    (system, talkgroups[i]) for i in positions if i < length and talkgroups[i].tg_tag == tag
+                )
+        return results
+
+    def freqs_with_tag(self, tag: Tag):
+        return list(self.freq_tags.get(tag, {}).values())
+
+    def freqs_with_mode(self, mode: Mode):
+        return list(self.modes.get(mode, {}).values())
+
+    def freqs_on(self, freq: float):
+        return list(self.frequencies.get(self.freq_key(freq), {}).values())
+
+    def agencies_in_county(self, county_name: str):
+        return list(self.counties.get(county_name, {}).values())
+
+class SiteIndex:
+    EARTH_RADIUS = 3958.8 # miles
+
+    def __init__(self, cell_size: float = 0.5):
+        self.cell_size = cell_size # degrees
+        self.columns = round(360 / cell_size)
+        self.cells: dict[tuple[int, int], list[tuple[System, Site]]] = defaultdict(list)
+        self.count = 0
+
+    @classmethod
+    def build(cls, db: "Database", cell_size: float = 0.5):
+        self = cls(cell_size)
+        for system in db.systems:
+            for site in system.sites:
+                self.add(system, site)
+        return self
+
+    @staticmethod
+    def distance(lat1: float, lon1: float, lat2: float, lon2: float):
+        lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        return 2 * SiteIndex.EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+    def cell(self, lat: float, lon: float):
+        return math.floor(lat / self.cell_size), self.column(math.floor(lon / self.cell_size))
+
+    def column(self, column: int):
+        # wrap around the antimeridian
+        return (column + self.columns // 2) % self.columns - self.columns // 2
+
+    def add(self, system: System, site: Site):
+        self.cells[self.cell(site.lat, site.long)].append((system, site))
+        self.count += 1
+
+    def candidates(self, lat: float, lon: float, radius: float):
+        lat_span = math.degrees(radius / self.EARTH_RADIUS)
+        min_lat = max(lat - lat_span, -90.0)
+        max_lat = min(lat + lat_span, 90.0)
+        rows = range(math.floor(min_lat / self.cell_size), math.floor(max_lat / self.cell_size) + 1)
+
+        cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+        if cos_lat <= 0 or lat_span / cos_lat >= 180:
+            columns = range(-(self.columns // 2), self.columns - self.columns // 2)
+        else:
+            lon_span = lat_span / cos_lat
+            columns = range(
+                math.floor((lon - lon_span) / self.cell_size),
+                math.floor((lon + lon_span) / self.cell_size) + 1
+            )
+
+        keys = set()
+        for row in rows:
+            for column in columns:
+                keys.add((row, self.column(column)))
+
+        for key in keys:
+            yield from self.cells.get(key, ())
+
+    def radius(self, lat: float, lon: float, radius: float):
+        results = []
+        for system, site in self.candidates(lat, lon, radius):
+            distance = self.distance(lat, lon, site.lat, site.long)
+            if distance <= radius:
+                results.append((distance, system, site))
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def nearest(self, lat: float, lon: float, k: int = 1):
+        if self.count == 0:
+            return []
+
+        # widen the search until it holds k sites, anything outside the radius is farther away
+        radius = self.cell_size * 69
+        while True:
+            results = self.radius(lat, lon, radius)
+            if len(results) >= min(k, self.count) or radius > math.pi * self.EARTH_RADIUS:
+                return results[:k]
+            radius *= 2
+
+    @staticmethod
+    def fingerprint(db: "Database"):
+        h = hashlib.sha256()
+        for system in db.systems:
+            h.update(json.dumps([system.system_id, [[site.site_id, site.lat, site.long] for site in system.sites]]).encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def site_key(site: Site):
+        # crawled sites carry their system's sid as site_id, so the location tells them apart
+        return site.site_id, site.lat, site.long
+
+    def serialize(self, db: "Database"):
+        cells = []
+        for (row, column), entries in self.cells.items():
+            sites = [[system.system_id, *self.site_key(site)] for system, site in entries]
+            cells.append({"row": row, "column": column, "sites": sites})
+        return {
+            "cell_size": self.cell_size,
+            "fingerprint": self.fingerprint(db),
+            "cells": cells
+        }
+
+    @classmethod
+    def deserialize(cls, site_index: dict, db: "Database"):
+        # an index saved before the database's sites changed is stale
+        if site_index.get("fingerprint") != cls.fingerprint(db):
+            raise ValueError("Site index doesn't match the database")
+
+        sites = {}
+        for system in db.systems:
+            for site in system.sites:
+                sites.setdefault((system.system_id, *cls.site_key(site)), []).append(site)
+
+        self = cls(site_index["cell_size"])
+        for cell in site_index["cells"]:
+            entries = self.cells[(cell["row"], cell["column"])]
+            for system_id, *key in cell["sites"]:
+                matches = sites.get((system_id, *key))
+                if not matches:
+                    raise ValueError("Site index doesn't match the database")
+                entries.append((db.index.system(system_id), matches.pop(0)))
+                self.count += 1
+        return self
+
+    def to_file(self, filename: str, db: "Database"):
+        with open(filename, "w") as f:
+            json.dump(self.serialize(db), f)
+
+    @classmethod
+    def from_file(cls, filename: str, db: "Database"):
+        with open(filename, "r") as f:
+            site_index = json.load(f)
+        return cls.deserialize(site_index, db)
+
+@dataclass
+class Coverage:
+    system: System
+    site: Site
+    distance: float # miles
+    in_range: bool # receiver is inside the site's advertised range
+
+class SiteArrays:
+    def __init__(self, db: "Database"):
+        self.entries: list[tuple[System, Site]] = []
+        lats = []
+        lons = []
+        ranges = []
+        for system in db.systems:
+            for site in system.sites:
+                self.entries.append((system, site))
+                lats.append(site.lat)
+                lons.append(site.long)
+                ranges.append(site.range)
+        self.lat = np.radians(np.asarray(lats, dtype=np.float64))
+        self.lon = np.radians(np.asarray(lons, dtype=np.float64))
+        self.range = np.asarray(ranges, dtype=np.float64)
+
+    def distances(self, receivers: list[tuple[float, float]]):
+        # receivers x sites matrix of great-circle distances in miles
+        points = np.radians(np.asarray(receivers, dtype=np.float64).reshape(-1, 2))
+        lat = points[:, 0:1]
+        lon = points[:, 1:2]
+        a = (
+            np.sin((self.lat - lat) / 2) ** 2
+            + np.cos(lat) * np.cos(self.lat) * np.sin((self.lon - lon) / 2) ** 2
+        )
+        return 2 * SiteIndex.EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    def coverage(self, receivers: list[tuple[float, float]], radius: float | None = None, limit: int | None = None):
+        distances = self.distances(receivers)
+        in_range = distances <= self.range
+        # without a radius only sites that advertise coverage of the receiver count
+        selected = in_range if radius is None else distances <= radius
+        order = np.argsort(np.where(selected, distances, np.inf), axis=1, kind="stable")
+        counts = selected.sum(axis=1)
+
+        results = []
+        for row in range(distances.shape[0]):
+            count = int(counts[row]) if limit is None else min(int(counts[row]), limit)
+            ranked = []
+            for column in order[row, :count]:
+                system, site = self.entries[column]
+                ranked.append(Coverage(
+                    system=system,
+                    site=site,
+                    distance=float(distances[row, column]),
+                    in_range=bool(in_range[row, column])
+                ))
+            results.append(ranked)
+        return results
+
 @dataclass
 class Database:
     systems: Systems
     agencies: Agencies
+    _index: DatabaseIndex | None = field(default=None, init=False, repr=False, compare=False)
+    _site_index: SiteIndex | None = field(default=None, init=False, repr=False, compare=False)
+    _site_arrays: SiteArrays | None = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = DatabaseIndex(self)
+        return self._index
+
+    @property
+    def site_index(self):
+        if self._site_index is None:
+            self._site_index = SiteIndex.build(self)
+        return self._site_index
+
+    @property
+    def site_arrays(self):
+        if self._site_arrays is None:
+            self._site_arrays = SiteArrays(self)
+        return self._site_arrays
+
+    def load_site_index(self, filename: str):
+        # a missing or stale index file is rebuilt and saved again
+        try:
+            self._site_index = SiteIndex.from_file(filename, self)
+        except (OSError, ValueError):
+            self._site_index = SiteIndex.build(self)
+            self._site_index.to_file(filename, self)
+        return self._site_index
+
+    def add_system(self, system: System):
+        if system.system_id in self.index.systems:
+            self.remove_system(system.system_id)
+        self.systems.append(system)
+        self._index.add_system(system)
+        if self._site_index is not None:
+            for site in system.sites:
+                self._site_index.add(system, site)
+        self._site_arrays = None
+
+    def remove_system(self, system_id: int):
+        for i, system in enumerate(self.systems):
+            if system.system_id == system_id:
+                del self.systems[i]
+                break
+        if self._index is not None:
+            self._index.remove_system(system_id)
+        self._site_index = None
+        self._site_arrays = None
+
+    def add_agency(self, agency: Agency):
+        if agency.agency_id in self.index.agencies:
+            self.remove_agency(agency.agency_id)
+        self.agencies.append(agency)
+        self._index.add_agency(agency)
+
+    def remove_agency(self, agency_id: int):
+        for i, agency in enumerate(self.agencies):
+            if agency.agency_id == agency_id:
+                del self.agencies[i]
+                break
+        if self._index is not None:
+            self._index.remove_agency(agency_id)
 
     def serialize(self):
         return {
@@ -451,6 +1099,362 @@ class Database:
             agencies = json.load(f)
         return cls.deserialize(agencies)
 
+    @staticmethod
+    def iter_systems(filename: str, predicate=None):
+        for system in JSONStream.iter_file(filename, "systems"):
+            if predicate is None or predicate(system):
+                yield System.deserialize(system)
+
+    @staticmethod
+    def iter_agencies(filename: str, predicate=None):
+        for agency in JSONStream.iter_file(filename, "agencies"):
+            if predicate is None or predicate(agency):
+                yield Agency.deserialize(agency)
+
+    @classmethod
+    def stream(cls, filename: str, system_predicate=None, agency_predicate=None):
+        return cls(
+            systems=_StreamedRecords(partial(cls.iter_systems, filename, system_predicate)),
+            agencies=_StreamedRecords(partial(cls.iter_agencies, filename, agency_predicate))
+        )
+
+    def to_binary(self, filename: str, compress: bool = True):
+        BinaryDatabase.write(self, filename, compress)
+
+    @classmethod
+    def from_binary(cls, filename: str):
+        with BinaryDatabase(filename) as db:
+            return db.load()
+
+    def to_sqlite(self, filename: str):
+        with SQLiteStore(filename) as store:
+            store.add_database(self)
+
+    @classmethod
+    def from_sqlite(cls, filename: str):
+        with SQLiteStore(filename) as store:
+            return store.load()
+
+    @classmethod
+    def merge(cls, databases: list):
+        # first occurrence wins for systems and agencies that span state lines
+        systems = {}
+        agencies = {}
+        for db in databases:
+            for system in db.systems:
+                systems.setdefault(system.system_id, system)
+            for agency in db.agencies:
+                agencies.setdefault(agency.agency_id, agency)
+        return cls(
+            systems=Systems(systems.values()),
+            agencies=Agencies(agencies.values())
+        )
+
+class _BlockWriter:
+    def __init__(self):
+        self.strings: dict[str, int] = {}
+        self.parts: list[bytes] = []
+
+    def string(self, value: str | None):
+        if value is None:
+            return -1
+        if value not in self.strings:
+            self.strings[value] = len(self.strings)
+        return self.strings[value]
+
+    def pack(self, fmt: str, *values):
+        self.parts.append(struct.pack(fmt, *values))
+
+    def array(self, typecode: str, values):
+        values = array(typecode, values)
+        if sys.byteorder != "little":
+            values.byteswap()
+        self.parts.append(values.tobytes())
+
+    def getvalue(self):
+        encoded = [value.encode("utf-8") for value in self.strings]
+        offsets = [0]
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        table = _BlockWriter()
+        table.pack("<I", len(encoded))
+        table.array("I", offsets)
+        return b"".join(table.parts) + b"".join(encoded) + b"".join(self.parts)
+
+class _BlockReader:
+    def __init__(self, buffer: bytes):
+        self.buffer = buffer
+        self.position = 0
+        count = self.unpack("<I")[0]
+        offsets = self.array("I", count + 1)
+        start = self.position
+        self.strings = [
+            _intern(buffer[start + offsets[i]:start + offsets[i + 1]].decode("utf-8"))
+            for i in range(count)
+        ]
+        self.position = start + offsets[-1]
+
+    def string(self, index: int):
+        return None if index < 0 else self.strings[index]
+
+    def unpack(self, fmt: str):
+        values = struct.unpack_from(fmt, self.buffer, self.position)
+        self.position += struct.calcsize(fmt)
+        return values
+
+    def array(self, typecode: str, count: int):
+        values = array(typecode)
+        end = self.position + values.itemsize * count
+        values.frombytes(self.buffer[self.position:end])
+        if sys.byteorder != "little":
+            values.byteswap()
+        self.position = end
+        return values
+
+class _LazyRecords(Sequence):
+    def __init__(self, decode, entries: list[tuple[int, int, int]]):
+        self.decode = decode
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.decode(*self.entries[j][1:]) for j in range(*i.indices(len(self)))]
+        return self.decode(*self.entries[i][1:])
+
+class BinaryDatabase:
+    MAGIC = b"PRDB"
+    VERSION = 1
+    COMPRESSED = 1
+    HEADER = struct.Struct("<4sHHQI") # magic, version, flags, table offset, meta length
+    ENTRY = struct.Struct("<qQI") # record id, block offset, block length
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.mmap = None
+        # empty files can't be mapped, the file is closed again whenever opening fails
+        try:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self.mmap) < self.HEADER.size:
+                raise ValueError(f"{filename} is not a version {self.VERSION} database file")
+            magic, version, flags, table_offset, meta_length = self.HEADER.unpack_from(self.mmap, 0)
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError(f"{filename} is not a version {self.VERSION} database file")
+            meta = json.loads(self.mmap[self.HEADER.size:self.HEADER.size + meta_length])
+
+            self.compressed = bool(flags & self.COMPRESSED)
+            self.tags = [Tag[name] for name in meta["tags"]]
+
+            entries = list(self.ENTRY.iter_unpack(
+                self.mmap[table_offset:table_offset + self.ENTRY.size * (meta["systems"] + meta["agencies"])]
+            ))
+            self.system_entries = entries[:meta["systems"]]
+            self.agency_entries = entries[meta["systems"]:]
+            self.system_positions = {entry[0]: i for i, entry in enumerate(self.system_entries)}
+            self.agency_positions = {entry[0]: i for i, entry in enumerate(self.agency_entries)}
+        except BaseException:
+            self.close()
+            raise
+
+        self.systems = _LazyRecords(self.decode_system, self.system_entries)
+        self.agencies = _LazyRecords(self.decode_agency, self.agency_entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.mmap is not None and not self.mmap.closed:
+            self.mmap.close()
+        self.file.close()
+
+    def block(self, offset: int, length: int):
+        block = self.mmap[offset:offset + length]
+        return zlib.decompress(block) if self.compressed else block
+
+    def system(self, system_id: int):
+        position = self.system_positions.get(system_id)
+        return None if position is None else self.systems[position]
+
+    def agency(self, agency_id: int):
+        position = self.agency_positions.get(agency_id)
+        return None if position is None else self.agencies[position]
+
+    def load(self):
+        return Database(systems=Systems(self.systems), agencies=Agencies(self.agencies))
+
+    @staticmethod
+    def encode_system(system: System, tags: dict[Tag, int]):
+        block = _BlockWriter()
+        block.pack(
+            "<qBiiII",
+            system.system_id,
+            system.modulation.value,
+            block.string(system.name),
+            block.string(system.last_updated),
+            len(system.talkgroups),
+            len(system.sites)
+        )
+
+        block.array("q", [talkgroup.tg_id for talkgroup in system.talkgroups])
+        block.array("B", [tags[talkgroup.tg_tag] for talkgroup in system.talkgroups])
+        block.array("I", [block.string(talkgroup.tg_name) for talkgroup in system.talkgroups])
+
+        block.array("q", [site.site_id for site in system.sites])
+        block.array("d", [site.lat for site in system.sites])
+        block.array("d", [site.long for site in system.sites])
+        block.array("d", [site.range for site in system.sites])
+        block.array("I", [block.string(site.name) for site in system.sites])
+        block.array("I", [len(site.control) for site in system.sites])
+        block.array("I", [len(site.channels) for site in system.sites])
+        block.array("d", [freq for site in system.sites for freq in site.control])
+        block.array("d", [freq for site in system.sites for freq in site.channels])
+        return block.getvalue()
+
+    def decode_system(self, offset: int, length: int):
+        block = _BlockReader(self.block(offset, length))
+        system_id, modulation, name, last_updated, talkgroup_count, site_count = block.unpack("<qBiiII")
+
+        tg_ids = block.array("q", talkgroup_count)
+        tg_tags = block.array("B", talkgroup_count)
+        tg_names = block.array("I", talkgroup_count)
+        talkgroups = Talkgroups()
+        talkgroups.ids = tg_ids
+        talkgroups.names = [block.strings[i] for i in tg_names]
+        talkgroups.tags = array("B", [Talkgroups.CODES[self.tags[code]] for code in tg_tags])
+
+        site_ids = block.array("q", site_count)
+        lats = block.array("d", site_count)
+        longs = block.array("d", site_count)
+        ranges = block.array("d", site_count)
+        names = block.array("I", site_count)
+        control_counts = block.array("I", site_count)
+        channel_counts = block.array("I", site_count)
+        control = block.array("d", sum(control_counts)).tolist()
+        channels = block.array("d", sum(channel_counts)).tolist()
+
+        sites = Sites()
+        control_start = 0
+        channel_start = 0
+        for i in range(site_count):
+            sites.append(Site(
+                name=block.strings[names[i]],
+                site_id=site_ids[i],
+                control=control[control_start:control_start + control_counts[i]],
+                channels=channels[channel_start:channel_start + channel_counts[i]],
+                lat=lats[i],
+                long=longs[i],
+                range=ranges[i]
+            ))
+            control_start += control_counts[i]
+            channel_start += channel_counts[i]
+
+        return System(
+            name=block.string(name),
+            system_id=system_id,
+            modulation=Modulation(modulation),
+            talkgroups=talkgroups,
+            sites=sites,
+            last_updated=block.string(last_updated)
+        )
+
+    @staticmethod
+    def encode_agency(agency: Agency, tags: dict[Tag, int]):
+        block = _BlockWriter()
+        block.pack(
+            "<qqiiiI",
+            agency.agency_id,
+            -1 if agency.parent_id is None else agency.parent_id,
+            block.string(agency.county_name),
+            block.string(agency.agency_name),
+            block.string(agency.last_updated),
+            len(agency.freqs)
+        )
+        block.array("d", [freq.freq for freq in agency.freqs])
+        block.array("B", [freq.tone.tone_type.value for freq in agency.freqs])
+        block.array("d", [freq.tone.tone_value for freq in agency.freqs])
+        block.array("B", [tags[freq.tag] for freq in agency.freqs])
+        block.array("B", [freq.mode.value for freq in agency.freqs])
+        block.array("I", [block.string(freq.name) for freq in agency.freqs])
+        return block.getvalue()
+
+    def decode_agency(self, offset: int, length: int):
+        block = _BlockReader(self.block(offset, length))
+        agency_id, parent_id, county_name, agency_name, last_updated, count = block.unpack("<qqiiiI")
+        freqs = block.array("d", count)
+        tone_types = block.array("B", count)
+        tone_values = block.array("d", count)
+        tags = block.array("B", count)
+        modes = block.array("B", count)
+        names = block.array("I", count)
+
+        return Agency(
+            agency_id=agency_id,
+            county_name=block.string(county_name),
+            agency_name=block.string(agency_name),
+            freqs=AgencyFreqs(
+                AgencyFreq(
+                    name=block.strings[names[i]],
+                    tone=Tone(ToneType(tone_types[i]), tone_values[i]),
+                    freq=freqs[i],
+                    tag=self.tags[tags[i]],
+                    mode=Mode(modes[i])
+                )
+                for i in range(count)
+            ),
+            parent_id=None if parent_id == -1 else parent_id,
+            last_updated=block.string(last_updated)
+        )
+
+    @classmethod
+    def write(cls, db: "Database", filename: str, compress: bool = True):
+        tags = {tag: i for i, tag in enumerate(Tag)}
+        meta = json.dumps({
+            "tags": [tag.name for tag in Tag],
+            "systems": len(db.systems),
+            "agencies": len(db.agencies)
+        }).encode("utf-8")
+
+        # write next to the target and swap it in so readers never see a partial file
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, temp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"\0" * cls.HEADER.size)
+                f.write(meta)
+
+                entries = []
+                records = [(system.system_id, cls.encode_system, system) for system in db.systems]
+                records += [(agency.agency_id, cls.encode_agency, agency) for agency in db.agencies]
+                for record_id, encode, record in records:
+                    block = encode(record, tags)
+                    if compress:
+                        block = zlib.compress(block)
+                    entries.append(cls.ENTRY.pack(record_id, f.tell(), len(block)))
+                    f.write(block)
+
+                table_offset = f.tell()
+                f.write(b"".join(entries))
+                f.seek(0)
+                flags = cls.COMPRESSED if compress else 0
+                f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, flags, table_offset, len(meta)))
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file owner-only, give it the permissions open() would have
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_filename, 0o666 & ~umask)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+
 @dataclass
 class Subcat:
     scid: int
@@ -478,9 +1482,1513 @@ class Subcat:
             range=subcat["range"]
         )
 
+@dataclass
+class CrawlPlan:
+    stid: int
+    state_name: str
+    counties: dict[int, str] # ctid -> county name, 0 is the state itself
+    systems: dict[int, str | None] # sid -> lastUpdated from trsList
+    agencies: list[int] # aid
+    county_subcats: dict[int, list] = field(default_factory=dict) # ctid -> subcats filed under the county itself
+    county_updated: dict[int, str | None] = field(default_factory=dict) # ctid -> lastUpdated
+
+    @classmethod
+    def from_api(cls, stid: int, state_info, county_infos: list):
+        counties = {0: state_info.stateName}
+        for county in state_info.countyList:
+            counties[county.ctid] = county.countyName
+
+        county_subcats = {}
+        county_updated = {}
+        for county_info in county_infos:
+            subcats = RadioReferenceAPI.parse_subcats(county_info)
+            if subcats:
+                county_subcats[county_info.ctid] = subcats
+            county_updated[county_info.ctid] = RadioReferenceAPI.parse_timestamp(county_info.lastUpdated)
+
+        systems = {}
+        agencies = {}
+        for county_info in county_infos:
+            for system in county_info.trsList or []:
+                systems.setdefault(system.sid, RadioReferenceAPI.parse_timestamp(system.lastUpdated))
+            for agency in county_info.agencyList or []:
+                agencies.setdefault(agency.aid, None)
+        for system in state_info.trsList or []:
+            systems.setdefault(system.sid, RadioReferenceAPI.parse_timestamp(system.lastUpdated))
+        for agency in state_info.agencyList or []:
+            agencies.setdefault(agency.aid, None)
+
+        return cls(
+            stid=stid,
+            state_name=state_info.stateName,
+            counties=counties,
+            systems=systems,
+            agencies=list(agencies),
+            county_subcats=county_subcats,
+            county_updated=county_updated
+        )
+
+    def missing_counties(self, agency_infos: list):
+        # agencies can sit in a county that isn't listed under this state
+        return sorted({agency_info.ctid for agency_info in agency_infos} - self.counties.keys())
+
+    def subcats(self, agency_infos: list):
+        ids = set()
+        subcats = []
+        for agency_info in agency_infos:
+            for subcat in RadioReferenceAPI.parse_subcats(agency_info):
+                if subcat.scid not in ids:
+                    ids.add(subcat.scid)
+                    subcats.append((subcat, agency_info, self.counties[agency_info.ctid]))
+        return subcats
+
+class Journal:
+    def __init__(self, filename: str, stid: int):
+        self.filename = filename
+        self.stid = stid
+        self.lock = threading.Lock()
+        self.systems: dict[int, System] = {}
+        self.agencies: dict[int, Agency] = {}
+
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line may be cut short if the crawl was killed mid write
+                        continue
+                    if entry["stid"] != stid:
+                        continue
+                    if entry["type"] == "system":
+                        system = System.deserialize(entry["data"])
+                        self.systems[system.system_id] = system
+                    elif entry["type"] == "agency":
+                        agency = Agency.deserialize(entry["data"])
+                        self.agencies[agency.agency_id] = agency
+
+        self.file = open(filename, "a")
+
+    def _write(self, entry_type: str, data: dict):
+        line = json.dumps({"stid": self.stid, "type": entry_type, "data": data})
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def add_system(self, system: System):
+        self._write("system", system.serialize())
+        self.systems[system.system_id] = system
+
+    def add_agency(self, agency: Agency):
+        self._write("agency", agency.serialize())
+        self.agencies[agency.agency_id] = agency
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+class SQLiteStore:
+    SCHEMA = """
+        -- ids are kept apart from rowid so load() returns records in the order they were added
+        CREATE TABLE IF NOT EXISTS systems (
+            system_id INTEGER NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            modulation INTEGER NOT NULL,
+            last_updated TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sites (
+            system_id INTEGER NOT NULL REFERENCES systems (system_id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            site_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            control TEXT NOT NULL,
+            channels TEXT NOT NULL,
+            lat REAL NOT NULL,
+            long REAL NOT NULL,
+            range REAL NOT NULL,
+            PRIMARY KEY (system_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS talkgroups (
+            system_id INTEGER NOT NULL REFERENCES systems (system_id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            tg_id INTEGER NOT NULL,
+            tg_name TEXT NOT NULL,
+            tg_tag TEXT NOT NULL,
+            PRIMARY KEY (system_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS agencies (
+            agency_id INTEGER NOT NULL UNIQUE,
+            county_name TEXT NOT NULL,
+            agency_name TEXT NOT NULL,
+            parent_id INTEGER,
+            last_updated TEXT
+        );
+        CREATE TABLE IF NOT EXISTS frequencies (
+            agency_id INTEGER NOT NULL REFERENCES agencies (agency_id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            freq REAL NOT NULL,
+            tone_type INTEGER NOT NULL,
+            tone_value REAL NOT NULL,
+            tag TEXT NOT NULL,
+            mode INTEGER NOT NULL,
+            PRIMARY KEY (agency_id, position)
+        );
+        CREATE INDEX IF NOT EXISTS systems_modulation ON systems (modulation);
+        CREATE INDEX IF NOT EXISTS sites_location ON sites (lat, long);
+        CREATE INDEX IF NOT EXISTS talkgroups_tag ON talkgroups (tg_tag);
+        CREATE INDEX IF NOT EXISTS talkgroups_id ON talkgroups (system_id, tg_id);
+        CREATE INDEX IF NOT EXISTS agencies_county ON agencies (county_name);
+        CREATE INDEX IF NOT EXISTS frequencies_tag ON frequencies (tag);
+        CREATE INDEX IF NOT EXISTS frequencies_mode ON frequencies (mode);
+        CREATE INDEX IF NOT EXISTS frequencies_freq ON frequencies (freq);
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _put_system(self, system: System):
+        self.connection.execute(
+            "INSERT INTO systems VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (system_id) DO UPDATE SET "
+            "name = excluded.name, modulation = excluded.modulation, last_updated = excluded.last_updated",
+            (system.system_id, system.name, system.modulation.value, system.last_updated)
+        )
+        self.connection.execute("DELETE FROM sites WHERE system_id = ?", (system.system_id,))
+        self.connection.execute("DELETE FROM talkgroups WHERE system_id = ?", (system.system_id,))
+        self.connection.executemany(
+            "INSERT INTO sites VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    system.system_id, i, site.site_id, site.name,
+                    json.dumps(site.control), json.dumps(site.channels),
+                    site.lat, site.long, site.range
+                )
+                for i, site in enumerate(system.sites)
+            ]
+        )
+        self.connection.executemany(
+            "INSERT INTO talkgroups VALUES (?, ?, ?, ?, ?)",
+            [
+                (system.system_id, i, talkgroup.tg_id, talkgroup.tg_name, talkgroup.tg_tag.name)
+                for i, talkgroup in enumerate(system.talkgroups)
+            ]
+        )
+
+    def _put_agency(self, agency: Agency):
+        self.connection.execute(
+            "INSERT INTO agencies VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (agency_id) DO UPDATE SET "
+            "county_name = excluded.county_name, agency_name = excluded.agency_name, "
+            "parent_id = excluded.parent_id, last_updated = excluded.last_updated",
+            (agency.agency_id, agency.county_name, agency.agency_name, agency.parent_id, agency.last_updated)
+        )
+        self.connection.execute("DELETE FROM frequencies WHERE agency_id = ?", (agency.agency_id,))
+        self.connection.executemany(
+            "INSERT INTO frequencies VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    agency.agency_id, i, freq.name, freq.freq,
+                    freq.tone.tone_type.value, freq.tone.tone_value,
+                    freq.tag.name, freq.mode.value
+                )
+                for i, freq in enumerate(agency.freqs)
+            ]
+        )
+
+    def add_system(self, system: System):
+        with self.lock, self.connection:
+            self._put_system(system)
+
+    def add_agency(self, agency: Agency):
+        with self.lock, self.connection:
+            self._put_agency(agency)
+
+    def add_database(self, db: "Database"):
+        with self.lock, self.connection:
+            for system in db.systems:
+                self._put_system(system)
+            for agency in db.agencies:
+                self._put_agency(agency)
+
+    def remove_system(self, system_id: int):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM systems WHERE system_id = ?", (system_id,))
+
+    def remove_agency(self, agency_id: int):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM agencies WHERE agency_id = ?", (agency_id,))
+
+    def _query(self, sql: str, params: list):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _where(clauses: list[tuple[str, list | None]]):
+        # each clause is a column and the values it may take, None means no filter
+        sql = []
+        params = []
+        for column, values in clauses:
+            if values is None:
+                continue
+            values = list(values)
+            sql.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        return (" WHERE " + " AND ".join(sql) if sql else ""), params
+
+    def system(self, system_id: int):
+        rows = self._query("SELECT * FROM systems WHERE system_id = ?", [system_id])
+        return self._system(rows[0]) if rows else None
+
+    def _system(self, row: tuple):
+        system_id, name, modulation, last_updated = row
+        sites = self._query(
+            "SELECT site_id, name, control, channels, lat, long, range FROM sites "
+            "WHERE system_id = ? ORDER BY position",
+            [system_id]
+        )
+        talkgroups = self._query(
+            "SELECT tg_id, tg_name, tg_tag FROM talkgroups WHERE system_id = ? ORDER BY position",
+            [system_id]
+        )
+        return System(
+            name=name,
+            system_id=system_id,
+            modulation=Modulation(modulation),
+            talkgroups=Talkgroups(
+                Talkgroup(tg_id=tg_id, tg_name=tg_name, tg_tag=Tag[tg_tag])
+                for tg_id, tg_name, tg_tag in talkgroups
+            ),
+            sites=Sites(
+                Site(
+                    name=site_name,
+                    site_id=site_id,
+                    control=json.loads(control),
+                    channels=json.loads(channels),
+                    lat=lat,
+                    long=long,
+                    range=site_range
+                )
+                for site_id, site_name, control, channels, lat, long, site_range in sites
+            ),
+            last_updated=last_updated
+        )
+
+    def agency(self, agency_id: int):
+        rows = self._query("SELECT * FROM agencies WHERE agency_id = ?", [agency_id])
+        return self._agency(rows[0]) if rows else None
+
+    def _agency(self, row: tuple):
+        agency_id, county_name, agency_name, parent_id, last_updated = row
+        freqs = self._query(
+            "SELECT name, freq, tone_type, tone_value, tag, mode FROM frequencies "
+            "WHERE agency_id = ? ORDER BY position",
+            [agency_id]
+        )
+        return Agency(
+            agency_id=agency_id,
+            county_name=county_name,
+            agency_name=agency_name,
+            freqs=AgencyFreqs(self._freq(freq) for freq in freqs),
+            parent_id=parent_id,
+            last_updated=last_updated
+        )
+
+    @staticmethod
+    def _freq(row: tuple):
+        name, freq, tone_type, tone_value, tag, mode = row
+        return AgencyFreq(
+            name=name,
+            tone=Tone(ToneType(tone_type), tone_value),
+            freq=freq,
+            tag=Tag[tag],
+            mode=Mode(mode)
+        )
+
+    def load(self):
+        systems = self._query("SELECT * FROM systems ORDER BY rowid", [])
+        agencies = self._query("SELECT * FROM agencies ORDER BY rowid", [])
+        return Database(
+            systems=Systems(self._system(row) for row in systems),
+            agencies=Agencies(self._agency(row) for row in agencies)
+        )
+
+    def talkgroups(
+            self,
+            modulations: list[Modulation] | None = None,
+            tags: list[Tag] | None = None,
+            system_ids: list[int] | None = None
+    ):
+        where, params = self._where([
+            ("s.modulation", None if modulations is None else [modulation.value for modulation in modulations]),
+            ("t.tg_tag", None if tags is None else [tag.name for tag in tags]),
+            ("t.system_id", system_ids)
+        ])
+        rows = self._query(
+            "SELECT t.system_id, t.tg_id, t.tg_name, t.tg_tag FROM talkgroups t "
+            "JOIN systems s ON s.system_id = t.system_id" + where + " ORDER BY t.system_id, t.position",
+            params
+        )
+        return [
+            (system_id, Talkgroup(tg_id=tg_id, tg_name=tg_name, tg_tag=Tag[tg_tag]))
+            for system_id, tg_id, tg_name, tg_tag in rows
+        ]
+
+    def frequencies(
+            self,
+            modes: list[Mode] | None = None,
+            tags: list[Tag] | None = None,
+            counties: list[str] | None = None,
+            low: float | None = None,
+            high: float | None = None
+    ):
+        where, params = self._where([
+            ("f.mode", None if modes is None else [mode.value for mode in modes]),
+            ("f.tag", None if tags is None else [tag.name for tag in tags]),
+            ("a.county_name", counties)
+        ])
+        for column, operator, value in (("f.freq", ">=", low), ("f.freq", "<=", high)):
+            if value is not None:
+                where += (" AND " if where else " WHERE ") + f"{column} {operator} ?"
+                params.append(value)
+        rows = self._query(
+            "SELECT f.agency_id, f.name, f.freq, f.tone_type, f.tone_value, f.tag, f.mode FROM frequencies f "
+            "JOIN agencies a ON a.agency_id = f.agency_id" + where + " ORDER BY f.agency_id, f.position",
+            params
+        )
+        return [(row[0], self._freq(row[1:])) for row in rows]
+
+    def sites(self, min_lat: float, min_long: float, max_lat: float, max_long: float):
+        rows = self._query(
+            "SELECT system_id, site_id, name, control, channels, lat, long, range FROM sites "
+            "WHERE lat BETWEEN ? AND ? AND long BETWEEN ? AND ? ORDER BY system_id, position",
+            [min_lat, max_lat, min_long, max_long]
+        )
+        return [
+            (
+                system_id,
+                Site(
+                    name=name,
+                    site_id=site_id,
+                    control=json.loads(control),
+                    channels=json.loads(channels),
+                    lat=lat,
+                    long=long,
+                    range=site_range
+                )
+            )
+            for system_id, site_id, name, control, channels, lat, long, site_range in rows
+        ]
+
+class ResponseCache:
+    MISS = object()
+    DAY = 24 * 60 * 60
+    default_ttls = {
+        "getStateInfo": DAY,
+        "getCountyInfo": DAY,
+        "getAgencyInfo": DAY,
+        "getTrsDetails": DAY,
+        "getTrsTalkgroups": DAY,
+        "getSubcatFreqs": DAY,
+        "getTrsSites": 7 * DAY,
+        "getCountiesByList": 7 * DAY,
+        "getStatesByList": 7 * DAY,
+    }
+
+    def __init__(
+            self,
+            filename: str = "cache.db",
+            ttl: float = DAY,
+            ttls: dict[str, float] | None = None,
+            max_size: int = 256 * 1024 * 1024
+    ):
+        self.filename = filename
+        self.ttl = ttl
+        self.ttls = dict(self.default_ttls)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_size = max_size
+        self.hits = Counter()
+        self.misses = Counter()
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "operation TEXT NOT NULL, "
+            "value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created REAL NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.connection.commit()
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(operation: str, kwargs: dict):
+        args = {}
+        for name, value in kwargs.items():
+            if name == "authInfo":
+                continue
+            args[name] = None if value is xsd.Nil else value
+        return operation + json.dumps(args, sort_keys=True, default=str)
+
+    def get(self, operation: str, kwargs: dict):
+        key = self.make_key(operation, kwargs)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, size, created FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.misses[operation] += 1
+                return self.MISS
+
+            value, size, created = row
+            try:
+                response = self.decode(value)
+            except ValueError:
+                # pickled by an older version of the cache
+                response = self.MISS
+            if response is self.MISS or now - created > self.ttls.get(operation, self.ttl):
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                self.size -= size
+                self.misses[operation] += 1
+                return self.MISS
+
+            self.connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                (now, key)
+            )
+            self.connection.commit()
+            self.hits[operation] += 1
+        return response
+
+    @staticmethod
+    def encode(response):
+        # zeep builds a class per soap array type at runtime, so responses can't be pickled,
+        # they are stored as json and come back as namespaces with the same attributes
+        def default(value):
+            if isinstance(value, Decimal):
+                return float(value)
+            if isinstance(value, (date, time_type)):
+                return value.isoformat()
+            raise TypeError(f"Can't cache {type(value).__name__}")
+
+        return json.dumps(serialize_object(response), default=default).encode()
+
+    @staticmethod
+    def decode(value: bytes):
+        return json.loads(value, object_hook=lambda fields: SimpleNamespace(**fields))
+
+    def put(self, operation: str, kwargs: dict, response):
+        key = self.make_key(operation, kwargs)
+        value = self.encode(response)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, operation, value, len(value), now, now)
+            )
+            self.size += len(value)
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        # least recently accessed entries go first
+        while self.size > self.max_size:
+            rows = self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                if self.size <= self.max_size:
+                    break
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "hits": sum(self.hits.values()),
+            "misses": sum(self.misses.values()),
+            "size": self.size,
+            "operations": {
+                operation: {
+                    "hits": self.hits[operation],
+                    "misses": self.misses[operation]
+                }
+                for operation in sorted(set(self.hits) | set(self.misses))
+            }
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class PlaylistWriter:
+    # writes the same layout as minidom's toprettyxml one element at a time
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.filename, "w")
+        self.file.write('<?xml version="1.0" ?>\n<playlist version="4">\n')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.file.write("</playlist>\n")
+        self.file.close()
+
+    @staticmethod
+    def escape(data: str):
+        return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+    @staticmethod
+    def render(element: ET.Element, indent: str = "\t"):
+        parts = []
+        PlaylistWriter._render(element, indent, parts)
+        return "".join(parts)
+
+    @staticmethod
+    def _render(element: ET.Element, indent: str, parts: list[str]):
+        parts.append(indent + "<" + element.tag)
+        for name, value in element.attrib.items():
+            parts.append(f' {name}="{PlaylistWriter.escape(value)}"')
+        if len(element):
+            parts.append(">\n")
+            for child in element:
+                PlaylistWriter._render(child, indent + "\t", parts)
+            parts.append(f"{indent}</{element.tag}>\n")
+        elif element.text:
+            parts.append(f">{PlaylistWriter.escape(element.text)}</{element.tag}>\n")
+        else:
+            parts.append("/>\n")
+
+    def write(self, element: ET.Element):
+        self.file.write(self.render(element))
+
+class ExportWriter:
+    # output target for RadioReferenceAPI.export, which feeds it every system and then every agency
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def system(self, system: System):
+        pass
+
+    def agency(self, agency: Agency):
+        pass
+
+class SDRTrunkWriter(ExportWriter):
+    # the playlist lists talkgroup aliases, site channels, freq aliases and then freq channels,
+    # so channels are held back until the aliases before them are written. when streaming they
+    # are spilled to temporary files, which costs writing them twice but keeps memory flat
+    def __init__(self, filename: str, stream: bool = False):
+        self.filename = filename
+        self.stream = stream
+        self.writer: PlaylistWriter | None = None
+        self.playlist: ET.Element | None = None
+        self.site_channels = []
+        self.freq_channels = []
+        self.freq_index = 1
+
+    def __enter__(self):
+        if self.stream:
+            self.site_channels = tempfile.TemporaryFile("w+")
+            self.freq_channels = tempfile.TemporaryFile("w+")
+            self.writer = PlaylistWriter(self.filename).__enter__()
+        else:
+            self.playlist = ET.Element("playlist", {"version": "4"})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.writer is not None:
+            try:
+                if exc_type is None:
+                    self.release(self.site_channels)
+                    self.release(self.freq_channels)
+            finally:
+                self.site_channels.close()
+                self.freq_channels.close()
+                self.writer.__exit__(exc_type, exc_value, traceback)
+            return
+
+        if exc_type is None:
+            self.release(self.site_channels)
+            self.release(self.freq_channels)
+            xml = parseString(ET.tostring(self.playlist))
+            xml = xml.toprettyxml()
+            with open(self.filename, "w") as f:
+                f.write(xml)
+
+    def emit(self, element: ET.Element):
+        if self.writer is not None:
+            self.writer.write(element)
+        else:
+            self.playlist.append(element)
+
+    def hold(self, held, element: ET.Element):
+        if self.writer is not None:
+            held.write(PlaylistWriter.render(element))
+        else:
+            held.append(element)
+
+    def release(self, held):
+        if self.writer is None:
+            self.playlist.extend(held)
+            held.clear()
+        elif held.tell():
+            held.seek(0)
+            shutil.copyfileobj(held, self.writer.file)
+            held.seek(0)
+            held.truncate()
+
+    def system(self, system: System):
+        for talkgroup in system.talkgroups:
+            self.emit(RadioReferenceAPI.sdrtrunk_talkgroup_alias(system, talkgroup))
+
+        for site in system.sites:
+            channel = RadioReferenceAPI.sdrtrunk_site_channel(system, site)
+            if channel is not None:
+                self.hold(self.site_channels, channel)
+
+    def agency(self, agency: Agency):
+        self.release(self.site_channels)
+        for freq in agency.freqs:
+            if freq.mode not in [Mode.FM, Mode.FMN, Mode.AM]:
+                continue
+            self.emit(RadioReferenceAPI.sdrtrunk_freq_alias(freq, self.freq_index))
+            self.hold(self.freq_channels, RadioReferenceAPI.sdrtrunk_freq_channel(agency, freq, self.freq_index))
+            self.freq_index += 1
+
+class IncrementalSDRTrunkWriter(ExportWriter):
+    # rendered aliases and channels are cached per system and agency under a hash of their content,
+    # so only changed records are rendered again. agency freq ids are left as a placeholder in the
+    # cache and numbered while writing, an agency gaining a freq doesn't invalidate the ones after it.
+    # agency aliases are keyed by agency id and freq name, the ids of the last write are kept in the
+    # state to map edits in the playlist back to them. fragments and state are stored as json
+    VERSION = 3
+    INDEX = "\x00"
+    # attributes users change in sdrtrunk, with the value the export writes
+    PRESERVED = {
+        "alias": {"color": "0", "iconName": None},
+        "channel": {"enabled": "false"}
+    }
+
+    def __init__(self, filename: str, cache: str = "fragments.db"):
+        self.filename = filename
+        self.cache = cache
+        self.connection: sqlite3.Connection | None = None
+        self.hashes: dict[str, str] = {}
+        self.lists: dict[str, str] = {}
+        self.system_keys = []
+        self.agency_keys = []
+        self.rendered: dict[str, tuple[str, str, list, list]] = {}
+        # playlist id -> agency alias key, recorded while writing
+        self.numbers: dict[str, str] = {}
+        self.state = None
+        self.reused = 0
+
+    def __enter__(self):
+        self.connection = sqlite3.connect(self.cache)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fragments ("
+            "key TEXT PRIMARY KEY, "
+            "hash TEXT NOT NULL, "
+            "list TEXT NOT NULL, "
+            "aliases BLOB NOT NULL, "
+            "channels BLOB NOT NULL)"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+        self.connection.commit()
+        for key, content_hash, name in self.connection.execute("SELECT key, hash, list FROM fragments"):
+            self.hashes[key] = content_hash
+            self.lists[key] = name
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.write()
+        finally:
+            self.connection.close()
+
+    @classmethod
+    def system_hash(cls, system: System):
+        h = hashlib.sha256(json.dumps([
+            cls.VERSION,
+            system.name,
+            system.system_id,
+            system.modulation.serialize(),
+            system.sites.serialize()
+        ]).encode())
+        talkgroups = system.talkgroups
+        if isinstance(talkgroups, Talkgroups):
+            h.update(talkgroups.ids.tobytes())
+            h.update(talkgroups.tags.tobytes())
+            h.update("\0".join(talkgroups.names).encode())
+        else:
+            h.update(json.dumps([talkgroup.serialize() for talkgroup in talkgroups]).encode())
+        return h.hexdigest()
+
+    @classmethod
+    def agency_hash(cls, agency: Agency):
+        return hashlib.sha256(json.dumps([cls.VERSION, agency.serialize()]).encode()).hexdigest()
+
+    def system(self, system: System):
+        key = f"system:{system.system_id}"
+        self.system_keys.append(key)
+        content_hash = self.system_hash(system)
+        if self.hashes.get(key) == content_hash:
+            self.reused += 1
+            return
+
+        aliases = []
+        for talkgroup in system.talkgroups:
+            alias = RadioReferenceAPI.sdrtrunk_talkgroup_alias(system, talkgroup)
+            aliases.append((("alias", system.name, talkgroup.tg_name, str(talkgroup.tg_id)), PlaylistWriter.render(alias)))
+
+        channels = []
+        for site in system.sites:
+            channel = RadioReferenceAPI.sdrtrunk_site_channel(system, site)
+            if channel is not None:
+                channels.append((("channel", system.name, site.name, "Control Channels"), PlaylistWriter.render(channel)))
+        self.rendered[key] = (content_hash, system.name, aliases, channels)
+
+    def agency(self, agency: Agency):
+        key = f"agency:{agency.agency_id}"
+        self.agency_keys.append(key)
+        content_hash = self.agency_hash(agency)
+        if self.hashes.get(key) == content_hash:
+            self.reused += 1
+            return
+
+        aliases = []
+        channels = []
+        names = Counter()
+        for freq in agency.freqs:
+            if freq.mode not in [Mode.FM, Mode.FMN, Mode.AM]:
+                continue
+            # freqs sharing a name within the agency are told apart by their order
+            names[freq.name] += 1
+            alias = RadioReferenceAPI.sdrtrunk_freq_alias(freq, self.INDEX)
+            alias_key = ("alias", "Agencies", freq.name, f"{agency.agency_id}:{names[freq.name]}")
+            aliases.append((alias_key, PlaylistWriter.render(alias)))
+            channel = RadioReferenceAPI.sdrtrunk_freq_channel(agency, freq, self.INDEX)
+            channels.append((("channel", agency.county_name, agency.agency_name, freq.name), PlaylistWriter.render(channel)))
+        self.rendered[key] = (content_hash, "Agencies", aliases, channels)
+
+    def fragments(self, keys: list[str], column: str):
+        for key in keys:
+            if key in self.rendered:
+                yield self.rendered[key][2 if column == "aliases" else 3]
+            else:
+                row = self.connection.execute(f"SELECT {column} FROM fragments WHERE key = ?", (key,)).fetchone()
+                yield [(tuple(item_key), text) for item_key, text in json.loads(row[0])]
+
+    @staticmethod
+    def encode_state(state: dict):
+        return json.dumps({**state, "overrides": [[key, attrib] for key, attrib in state["overrides"].items()]})
+
+    @staticmethod
+    def decode_state(value):
+        state = json.loads(value)
+        state["overrides"] = {tuple(key): attrib for key, attrib in state["overrides"]}
+        return state
+
+    def load_state(self):
+        # the playlist is only parsed again when it changed since the last export wrote it
+        row = self.connection.execute("SELECT value FROM state WHERE key = 'playlist'").fetchone()
+        try:
+            state = self.decode_state(row[0]) if row else None
+        except ValueError:
+            # pickled by an older version of the cache
+            state = None
+        if not os.path.exists(self.filename):
+            return {"overrides": {}, "extras": [], "numbers": {}}
+        stat = os.stat(self.filename)
+        if state and state["mtime_ns"] == stat.st_mtime_ns and state["size"] == stat.st_size:
+            return state
+
+        # entries in lists this export writes, or wrote last time, are replaced, anything else is kept
+        managed = {"Agencies"} | set(self.lists.values())
+        managed.update(self.rendered[key][1] for key in self.system_keys if key in self.rendered)
+        numbers = state.get("numbers", {}) if state else {}
+        overrides = {}
+        extras = []
+        for element in ET.parse(self.filename).getroot():
+            if element.tag == "alias" and element.get("list") in managed:
+                ids = [item.get("value") for item in element.iter("id") if item.get("type") == "talkgroup"]
+                alias_id = ids[0] if ids else None
+                if element.get("list") == "Agencies":
+                    alias_id = numbers.get(alias_id, alias_id)
+                key = ("alias", element.get("list"), element.get("name"), alias_id)
+            elif element.tag == "channel" and element.findtext("alias_list_name") in managed:
+                key = ("channel", element.get("system"), element.get("site"), element.get("name"))
+            else:
+                extras.append(PlaylistWriter.render(element))
+                continue
+            attrib = {name: element.get(name) for name in self.PRESERVED[element.tag]}
+            if attrib != self.PRESERVED[element.tag]:
+                overrides[key] = attrib
+        return {"overrides": overrides, "extras": extras, "numbers": numbers}
+
+    @staticmethod
+    def patch(text: str, attrib: dict):
+        element = ET.fromstring(text)
+        for name, value in attrib.items():
+            if value is None:
+                element.attrib.pop(name, None)
+            else:
+                element.set(name, value)
+        return PlaylistWriter.render(element)
+
+    def write_items(self, f, fragments, overrides: dict, numbered: bool):
+        index = 1
+        for items in fragments:
+            for key, text in items:
+                if numbered:
+                    text = text.replace(self.INDEX, str(index))
+                    if key[0] == "alias":
+                        self.numbers[str(index)] = key[3]
+                    index += 1
+                if overrides and key in overrides:
+                    text = self.patch(text, overrides[key])
+                f.write(text)
+
+    def write(self):
+        self.state = self.load_state()
+        overrides = self.state["overrides"]
+
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, temp_filename = tempfile.mkstemp(dir=directory, prefix=".playlist-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write('<?xml version="1.0" ?>\n<playlist version="4">\n')
+                self.write_items(f, self.fragments(self.system_keys, "aliases"), overrides, False)
+                self.write_items(f, self.fragments(self.system_keys, "channels"), overrides, False)
+                self.write_items(f, self.fragments(self.agency_keys, "aliases"), overrides, True)
+                self.write_items(f, self.fragments(self.agency_keys, "channels"), overrides, True)
+                for text in self.state["extras"]:
+                    f.write(text)
+                f.write("</playlist>\n")
+            # mkstemp creates the file owner-only, give it the permissions open() would have
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_filename, 0o666 & ~umask)
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+        keys = set(self.system_keys) | set(self.agency_keys)
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM fragments WHERE key = ?",
+                [(key,) for key in self.hashes if key not in keys]
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fragments (key, hash, list, aliases, channels) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (key, content_hash, name, json.dumps(aliases), json.dumps(channels))
+                    for key, (content_hash, name, aliases, channels) in self.rendered.items()
+                ]
+            )
+            stat = os.stat(self.filename)
+            self.state = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "overrides": overrides,
+                "extras": self.state["extras"],
+                "numbers": self.numbers
+            }
+            self.connection.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES ('playlist', ?)",
+                (self.encode_state(self.state),)
+            )
+
+    def stats(self):
+        return {"rendered": len(self.rendered), "reused": self.reused}
+
+class OP25Writer(ExportWriter):
+    # a trunk.tsv row per p25 control site and a talkgroup tags file per system,
+    # conventional agency freqs have no place in op25's trunking config
+    TRUNK_HEADER = [
+        "Sysname",
+        "Control Channel List",
+        "Offset",
+        "NAC",
+        "Modulation",
+        "TGID Tags File",
+        "Whitelist",
+        "Blacklist",
+        "Center Frequency"
+    ]
+
+    def __init__(
+            self,
+            directory: str,
+            trunk_file: str = "trunk.tsv",
+            modulation: str = "c4fm",
+            modulations: dict[int, str] | None = None
+    ):
+        self.directory = directory
+        self.trunk_file = trunk_file
+        # phase 2 systems still send their control channel as phase 1, c4fm unless the site is simulcast,
+        # which radio reference doesn't say. modulations overrides it per system id, e.g. with cqpsk
+        self.modulation = modulation
+        self.modulations = modulations or {}
+        self.file = None
+        self.trunk = None
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.file = open(os.path.join(self.directory, self.trunk_file), "w", newline="")
+        self.trunk = csv.writer(self.file, delimiter="\t", quoting=csv.QUOTE_ALL, lineterminator="\n")
+        self.trunk.writerow(self.TRUNK_HEADER)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+    def system(self, system: System):
+        if system.modulation not in [Modulation.P25, Modulation.P25_P1, Modulation.P25_P2]:
+            return
+        sites = [site for site in system.sites if len(site.control)]
+        if not sites:
+            return
+
+        # op25 resolves paths against its own working directory
+        tags_file = os.path.abspath(os.path.join(self.directory, f"{system.system_id}.tsv"))
+        with open(tags_file, "w", newline="") as f:
+            tags = csv.writer(f, delimiter="\t", lineterminator="\n")
+            for talkgroup in system.talkgroups:
+                tags.writerow([talkgroup.tg_id, talkgroup.tg_name])
+
+        modulation = self.modulations.get(system.system_id, self.modulation)
+        for site in sites:
+            self.trunk.writerow([
+                f"{system.name} {site.name}",
+                ",".join(str(freq) for freq in site.control),
+                "0",
+                "0",
+                modulation,
+                tags_file,
+                "",
+                "",
+                ""
+            ])
+
+WSDL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.xml")
+
+_documents: dict[str, Document] = {}
+_documents_lock = threading.Lock()
+
+def _load_wsdl(settings: Settings):
+    # compiled documents hold thread locals and can't be pickled, so they are shared per process
+    # keyed by the schema hash, and the imported soap encoding schema is kept in zeep's on-disk cache
+    with open(WSDL, "rb") as f:
+        key = hashlib.sha256(f.read()).hexdigest()
+    with _documents_lock:
+        if key not in _documents:
+            transport = Transport(cache=SqliteCache(timeout=None))
+            _documents[key] = Document(WSDL, transport, settings=settings)
+        return _documents[key]
+
+class Metrics:
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # seconds
+    PREFIX = "pyradiodb"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations: dict[str, dict] = {}
+        self.phases: dict[str, dict] = {}
+
+    def operation(self, operation: str):
+        if operation not in self.operations:
+            self.operations[operation] = {
+                "calls": 0,
+                "errors": 0,
+                "cached": 0,
+                "latency_sum": 0.0,
+                "latency_buckets": [0] * (len(self.BUCKETS) + 1), # the last one is +Inf
+                "response_bytes": 0
+            }
+        return self.operations[operation]
+
+    def observe_call(self, operation: str, elapsed: float, ok: bool = True):
+        with self.lock:
+            stats = self.operation(operation)
+            stats["calls"] += 1
+            if not ok:
+                stats["errors"] += 1
+            stats["latency_sum"] += elapsed
+            for i, bound in enumerate(self.BUCKETS):
+                if elapsed <= bound:
+                    break
+            else:
+                i = len(self.BUCKETS)
+            stats["latency_buckets"][i] += 1
+
+    def observe_cached(self, operation: str):
+        with self.lock:
+            self.operation(operation)["cached"] += 1
+
+    def observe_size(self, operation: str, size: int):
+        with self.lock:
+            self.operation(operation)["response_bytes"] += size
+
+    def observe_phase(self, phase: str, elapsed: float, items: int):
+        with self.lock:
+            stats = self.phases.setdefault(phase, {"runs": 0, "seconds": 0.0, "items": 0})
+            stats["runs"] += 1
+            stats["seconds"] += elapsed
+            stats["items"] += items
+
+    @contextmanager
+    def phase(self, phase: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.monotonic() - start, 0)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "buckets": list(self.BUCKETS),
+                "operations": {name: dict(stats, latency_buckets=list(stats["latency_buckets"])) for name, stats in self.operations.items()},
+                "phases": {name: dict(stats) for name, stats in self.phases.items()}
+            }
+
+    def to_json(self, filename: str | None = None):
+        metrics = json.dumps(self.to_dict(), indent=4)
+        if filename is not None:
+            self.write(filename, metrics)
+        return metrics
+
+    def to_prometheus(self, filename: str | None = None):
+        metrics = self.to_dict()
+        prefix = self.PREFIX
+        lines = []
+
+        def family(name: str, kind: str, description: str):
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        operations = sorted(metrics["operations"].items())
+        for key, name, description in (
+                ("calls", "calls_total", "SOAP calls sent, retries included"),
+                ("errors", "errors_total", "SOAP calls that failed"),
+                ("cached", "cache_hits_total", "Calls answered by the response cache"),
+                ("response_bytes", "response_bytes_total", "Decoded response bytes")
+        ):
+            family(name, "counter", description)
+            for operation, stats in operations:
+                lines.append(f'{prefix}_{name}{{operation="{operation}"}} {stats[key]}')
+
+        family("call_duration_seconds", "histogram", "SOAP call latency")
+        for operation, stats in operations:
+            total = 0
+            for bound, count in zip(list(self.BUCKETS) + ["+Inf"], stats["latency_buckets"]):
+                total += count
+                lines.append(f'{prefix}_call_duration_seconds_bucket{{operation="{operation}",le="{bound}"}} {total}')
+            lines.append(f'{prefix}_call_duration_seconds_sum{{operation="{operation}"}} {stats["latency_sum"]}')
+            lines.append(f'{prefix}_call_duration_seconds_count{{operation="{operation}"}} {total}')
+
+        phases = sorted(metrics["phases"].items())
+        family("phase_duration_seconds", "counter", "Wall time spent in each crawl phase")
+        for phase, stats in phases:
+            lines.append(f'{prefix}_phase_duration_seconds{{phase="{phase}"}} {stats["seconds"]}')
+        family("phase_items_total", "counter", "Items completed in each crawl phase")
+        for phase, stats in phases:
+            lines.append(f'{prefix}_phase_items_total{{phase="{phase}"}} {stats["items"]}')
+
+        text = "\n".join(lines) + "\n"
+        if filename is not None:
+            self.write(filename, text)
+        return text
+
+    @staticmethod
+    def write(filename: str, text: str):
+        # textfile collectors may read at any time, so never leave a half written file behind
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, temp_filename = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_filename, 0o666 & ~umask)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+
+class ProgressHook:
+    # the default hook shows nothing, subclasses or any callable returning an object
+    # with update and close can be passed as progress_hook
+    def __init__(self, phase: str, total: int, initial: int = 0):
+        self.phase = phase
+
+    def update(self, n: int = 1):
+        pass
+
+    def close(self):
+        pass
+
+class TqdmProgress(ProgressHook):
+    def __init__(self, phase: str, total: int, initial: int = 0):
+        super().__init__(phase, total, initial)
+        self.bar = tqdm(desc="Progress", total=total, initial=initial)
+
+    def update(self, n: int = 1):
+        self.bar.update(n)
+
+    def close(self):
+        self.bar.close()
+
+class _PhaseProgress:
+    # times a crawl phase for the metrics while forwarding progress to the hook
+    def __init__(self, metrics: Metrics, hook, phase: str):
+        self.metrics = metrics
+        self.hook = hook
+        self.phase = phase
+        self.items = 0
+        self.start = time.monotonic()
+        self.closed = False
+
+    def update(self, n: int = 1):
+        self.items += n
+        self.hook.update(n)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.metrics.observe_phase(self.phase, time.monotonic() - self.start, self.items)
+            self.hook.close()
+
+class TransportStats:
+    metrics: "Metrics | None" = None
+
+    def reset_stats(self):
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0 # on the wire, before decompression
+        self.bytes_decoded = 0
+
+    def count(self, sent: int, received: int, decoded: int, headers: dict):
+        with self.stats_lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.bytes_decoded += decoded
+        if self.metrics is not None:
+            # the operation name is only known here through the soap action
+            operation = headers.get("SOAPAction", "").strip('"').rpartition("#")[2]
+            if operation:
+                self.metrics.observe_size(operation, decoded)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "bytes_decoded": self.bytes_decoded
+        }
+
+class PooledTransport(Transport, TransportStats):
+    def __init__(
+            self,
+            workers: int = 1,
+            timeout: float = 30,
+            operation_timeout: float = 60,
+            cache=None
+    ):
+        session = requests.Session()
+        # one keep-alive connection per worker, so threads neither queue on the pool nor reconnect
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        super().__init__(cache=cache, timeout=timeout, operation_timeout=operation_timeout, session=session)
+        self._close_session = True
+        self.reset_stats()
+
+    def post(self, address, message, headers):
+        response = super().post(address, message, headers)
+        content = response.content
+        received = response.raw.tell() if response.raw is not None else len(content)
+        self.count(len(message), received, len(content), headers)
+        return response
+
+class AsyncPooledTransport(AsyncTransport, TransportStats):
+    def __init__(
+            self,
+            concurrency: int = 8,
+            timeout: float = 30,
+            operation_timeout: float = 60,
+            cache=None
+    ):
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            timeout=operation_timeout
+        )
+        super().__init__(client=client, cache=cache, timeout=timeout, operation_timeout=operation_timeout)
+        # AsyncTransport replaces the client headers, which drops httpx's compression negotiation
+        self.client.headers["Accept-Encoding"] = "gzip, deflate"
+        self.reset_stats()
+
+    async def post(self, address, message, headers):
+        response = await super().post(address, message, headers)
+        content = await response.aread()
+        self.count(len(message), response.num_bytes_downloaded, len(content), headers)
+        return response
+
+class RequestScheduler:
+    TRANSIENT = (TransportError, requests.ConnectionError, requests.Timeout, httpx.TransportError)
+    # the api reports overload and server trouble as soap faults too, but most faults are
+    # permanent (bad credentials, unknown ids) and retrying those only delays the error
+    TRANSIENT_FAULT = re.compile(
+        r"overload|busy|too many|rate limit|try again|timed? ?out|unavailable|temporar|maintenance|"
+        r"internal (server )?error|database error",
+        re.IGNORECASE
+    )
+
+    def __init__(
+            self,
+            max_concurrency: int = 8,
+            rate: float | None = None,
+            burst: int = 1,
+            retries: int = 4,
+            backoff: float = 0.5,
+            max_backoff: float = 30,
+            slow: float = 10
+    ):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.rate = rate # requests per second, None for no limit
+        self.burst = max(burst, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.slow = slow # seconds, a slower response counts as congestion
+
+        self.limit = 1.0
+        self.in_flight = 0
+        self.tokens = float(self.burst)
+        self.refilled = time.monotonic()
+        self.decreased = 0.0
+        self.latency = 0.0
+        self.calls = 0
+        self.retried = 0
+        self.errors = 0
+        self.condition = threading.Condition()
+
+    def take_token(self):
+        # returns how long to wait before a token is available, takes it when there is no wait
+        if self.rate is None:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def record(self, elapsed: float, ok: bool):
+        # slow start until the first congestion, then additive increase of one slot per window of
+        # successes; halve on errors or slow responses, at most once per average response time
+        # so one burst of failures only counts once
+        self.in_flight -= 1
+        self.calls += 1
+        self.latency = elapsed if self.calls == 1 else 0.8 * self.latency + 0.2 * elapsed
+        if not ok:
+            self.errors += 1
+        now = time.monotonic()
+        if ok and elapsed < self.slow:
+            step = 1 if self.decreased == 0 else 1 / self.limit
+            self.limit = min(self.max_concurrency, self.limit + step)
+        elif now - self.decreased > self.latency:
+            self.limit = max(1.0, self.limit / 2)
+            self.decreased = now
+
+    @classmethod
+    def transient(cls, error: BaseException):
+        if isinstance(error, Fault):
+            return bool(cls.TRANSIENT_FAULT.search(f"{error.code or ''} {error.message or ''}"))
+        return isinstance(error, cls.TRANSIENT)
+
+    def delay(self, attempt: int):
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        while True:
+            with self.condition:
+                wait = self.take_token()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def release(self, elapsed: float, ok: bool):
+        with self.condition:
+            self.record(elapsed, ok)
+            self.condition.notify_all()
+
+    def call(self, func, idempotent: bool = True):
+        attempt = 0
+        while True:
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = func()
+            except BaseException as e:
+                transient = self.transient(e)
+                self.release(time.monotonic() - start, not transient)
+                if not transient or not idempotent or attempt >= self.retries:
+                    raise
+            else:
+                self.release(time.monotonic() - start, True)
+                return result
+            time.sleep(self.delay(attempt))
+            attempt += 1
+            self.retried += 1
+
+    def settings(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rate": self.rate,
+            "burst": self.burst,
+            "retries": self.retries,
+            "backoff": self.backoff,
+            "max_backoff": self.max_backoff,
+            "slow": self.slow
+        }
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "retried": self.retried,
+            "errors": self.errors,
+            "latency": self.latency
+        }
+
+class AsyncRequestScheduler(RequestScheduler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.condition = None
+
+    async def acquire(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        while (wait := self.take_token()) > 0:
+            await asyncio.sleep(wait)
+
+    async def release(self, elapsed: float, ok: bool):
+        async with self.condition:
+            self.record(elapsed, ok)
+            self.condition.notify_all()
+
+    async def call(self, func, idempotent: bool = True):
+        attempt = 0
+        while True:
+            await self.acquire()
+            start = time.monotonic()
+            try:
+                result = await func()
+            except BaseException as e:
+                transient = self.transient(e)
+                await self.release(time.monotonic() - start, not transient)
+                if not transient or not idempotent or attempt >= self.retries:
+                    raise
+            else:
+                await self.release(time.monotonic() - start, True)
+                return result
+            await asyncio.sleep(self.delay(attempt))
+            attempt += 1
+            self.retried += 1
+
 class RadioReferenceAPI(Client):
-    def __init__(self, username: str, password: str):
-        super().__init__(wsdl="./schema.xml", settings=Settings(strict=False))
+    def __init__(
+            self,
+            username: str,
+            password: str,
+            workers: int = 1,
+            cache: ResponseCache | None = None,
+            transport: Transport | None = None,
+            scheduler: RequestScheduler | None = None,
+            batch_size: int = 100,
+            metrics: Metrics | None = None,
+            progress_hook=None,
+            address: str | None = None
+    ):
+        settings = Settings(strict=False)
+        if transport is None:
+            transport = PooledTransport(workers=workers)
+        super().__init__(wsdl=_load_wsdl(settings), settings=settings, transport=transport)
+        if address is not None:
+            # point the service at another endpoint, e.g. a local mock server
+            self._default_service = ServiceProxy(self, next(iter(self.wsdl.bindings.values())), address=address)
+        self.address = address
         self.username = username
         self.password = password
         self.auth_info = {
@@ -490,34 +2998,61 @@ class RadioReferenceAPI(Client):
             'version': 'latest',
             'style': 'rpc'
         }
-        self.progress: tqdm | None = None
-
-    def get_talkgroups(self, sid: int):
-        tgs = self.service.getTrsTalkgroups(
-            authInfo=self.auth_info,
-            sid=sid,
-            tgCid=xsd.Nil,
-            tgTag=xsd.Nil,
-            tgDec=xsd.Nil
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.progress_hook = progress_hook or (TqdmProgress if tqdm is not None else ProgressHook)
+        self.progress: _PhaseProgress | None = None
+        if isinstance(self.transport, TransportStats):
+            self.transport.metrics = self.metrics
+        self.workers = workers
+        self.cache = cache
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler(max_concurrency=workers)
+        self.batch_size = batch_size
+
+    def start_progress(self, phase: str, total: int, initial: int = 0):
+        return _PhaseProgress(self.metrics, self.progress_hook(phase, total, initial), phase)
+
+    def _request(self, operation: str, **kwargs):
+        start = time.monotonic()
+        try:
+            response = self.service[operation](authInfo=self.auth_info, **kwargs)
+        except BaseException:
+            self.metrics.observe_call(operation, time.monotonic() - start, False)
+            raise
+        self.metrics.observe_call(operation, time.monotonic() - start)
+        return response
+
+    def _call(self, operation: str, **kwargs):
+        if self.cache is not None:
+            response = self.cache.get(operation, kwargs)
+            if response is not ResponseCache.MISS:
+                self.metrics.observe_cached(operation)
+                return response
+
+        response = self.scheduler.call(
+            partial(self._request, operation, **kwargs),
+            idempotent=operation.startswith("get")
         )
+        if self.cache is not None:
+            self.cache.put(operation, kwargs, response)
+        return response
+
+    @staticmethod
+    def parse_talkgroups(tgs):
         talkgroups = []
-        for tg in tgs:
+        for tg in tgs or []:
             tag = Tag.convert_tag(tg.tags[0].tagId)
             talkgroup = Talkgroup(
                 tg_id=tg.tgDec,
-                tg_name=tg.tgDescr,
+                tg_name=_intern(tg.tgDescr),
                 tg_tag=tag
             )
             talkgroups.append(talkgroup)
         return Talkgroups(talkgroups)
 
-    def get_sites(self, sid: int):
-        api_sites = self.service.getTrsSites(
-            authInfo=self.auth_info,
-            sid=sid
-        )
+    @staticmethod
+    def parse_sites(api_sites):
         sites = []
-        for site in api_sites:
+        for site in api_sites or []:
             control = []
             channels = []
             for freq in site.siteFreqs:
@@ -526,7 +3061,7 @@ class RadioReferenceAPI(Client):
                 else:
                     channels.append(float(freq.freq))
             site = Site(
-                name=site.siteDescr,
+                name=_intern(site.siteDescr),
                 site_id=site.sid,
                 control=control,
                 channels=channels,
@@ -537,437 +3072,889 @@ class RadioReferenceAPI(Client):
             sites.append(site)
         return Sites(sites)
 
-    def get_all_systems(self, stid: int):
-        state_info = self.service.getStateInfo(
-            authInfo=self.auth_info,
-            stid=stid
+    @staticmethod
+    def parse_timestamp(value):
+        if value is None:
+            return None
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+
+    @staticmethod
+    def parse_system(sid: int, system_info, sites: Sites, talkgroups: Talkgroups):
+        modulation = Modulation.convert_stype(
+            system_info.sType,
+            system_info.sFlavor
+        )
+        return System(
+            name=system_info.sName,
+            system_id=sid,
+            modulation=modulation,
+            talkgroups=talkgroups,
+            sites=sites,
+            last_updated=RadioReferenceAPI.parse_timestamp(system_info.lastUpdated)
         )
 
-        self.progress = tqdm(desc="Progress", total=len(state_info.countyList))
+    @staticmethod
+    def parse_subcats(agency_info):
+        subcats = []
+        if agency_info.cats:
+            for cat in agency_info.cats:
+                if cat.subcats:
+                    for subcat in cat.subcats:
+                        subcats.append(subcat)
+        return subcats
 
-        number = 0
-        county_infos = []
-        for county in state_info.countyList:
-            county_info = self.service.getCountyInfo(
-                authInfo=self.auth_info,
-                ctid=county.ctid
-            )
-            number += len(county_info.trsList) + 1
-            county_infos.append(county_info)
-            self.progress.update(1)
+    @staticmethod
+    def parse_freq(freq):
+        mode = Mode(int(freq.mode))
+        if mode in [Mode.P25, Mode.DMR, Mode.NXDN48, Mode.NXDN96]:
+            return None
+
+        if freq.tone:
+            if freq.tone.endswith(" PL"):
+                tone_type = ToneType.CTCSS
+                tone_value = float(freq.tone.replace("PL", ""))
+            elif freq.tone.endswith("DPL"):
+                tone_type = ToneType.DCS
+                tone_value = float(freq.tone.replace("DPL", ""))
+            else:
+                tone_type = ToneType.NONE
+                tone_value = 0
+        else:
+            tone_type = ToneType.NONE
+            tone_value = 0
+
+        tone = Tone(tone_type, tone_value)
+        tag = Tag.convert_tag(int(freq.tags[0].tagId))
+
+        return AgencyFreq(
+            name=_intern(freq.descr),
+            freq=float(freq.out),
+            tone=tone,
+            mode=mode,
+            tag=tag
+        )
 
-        total = number + len(state_info.trsList)
-        self.progress.close()
-        self.progress = tqdm(desc="Progress", total=total)
+    @staticmethod
+    def parse_agency(subcat, agency_info, county_name: str, freqs):
+        return RadioReferenceAPI.parse_subcat_agency(
+            subcat,
+            county_name,
+            freqs,
+            agency_info.aid,
+            RadioReferenceAPI.parse_timestamp(agency_info.lastUpdated)
+        )
 
-        ids = []
-        systems = []
-        for county_info in county_infos:
-            for system in county_info.trsList:
-                if system.sid not in ids:
-                    system_info = self.service.getTrsDetails(
-                        authInfo=self.auth_info,
-                        sid=system.sid
-                    )
-                    modulation = Modulation.convert_stype(
-                        system_info.sType,
-                        system_info.sFlavor
-                    )
-                    sites = self.get_sites(system.sid)
-                    talkgroups = self.get_talkgroups(system.sid)
-
-                    system = System(
-                        name=system_info.sName,
-                        system_id=system.sid,
-                        modulation=modulation,
-                        talkgroups=talkgroups,
-                        sites=sites
-                    )
-                    systems.append(system)
-                    ids.append(system.system_id)
-
-                self.progress.update(1)
-            self.progress.update(1)
+    @staticmethod
+    def parse_subcat_agency(subcat, county_name: str, freqs, parent_id: int | None, last_updated: str | None):
+        agency_freqs = AgencyFreqs([])
+        for freq in freqs or []:
+            if freq.out:
+                agency_freq = RadioReferenceAPI.parse_freq(freq)
+                if agency_freq is not None:
+                    agency_freqs.append(agency_freq)
+
+        return Agency(
+            agency_id=subcat.scid,
+            county_name=_intern(county_name),
+            agency_name=_intern(subcat.scName),
+            freqs=agency_freqs,
+            parent_id=parent_id,
+            last_updated=last_updated
+        )
 
-        for system in state_info.trsList:
-            if system.sid not in ids:
-                system_info = self.service.getTrsDetails(
-                    authInfo=self.auth_info,
-                    sid=system.sid
-                )
+    def get_talkgroups(self, sid: int):
+        tgs = self._call(
+            "getTrsTalkgroups",
+            sid=sid,
+            tgCid=xsd.Nil,
+            tgTag=xsd.Nil,
+            tgDec=xsd.Nil
+        )
+        return self.parse_talkgroups(tgs)
 
-                modulation = Modulation.convert_stype(
-                    system_info.sType,
-                    system_info.sFlavor
-                )
-                sites = self.get_sites(system.sid)
-                talkgroups = self.get_talkgroups(system.sid)
-
-                system = System(
-                    name=system_info.sName,
-                    system_id=system.sid,
-                    modulation=modulation,
-                    talkgroups=talkgroups,
-                    sites=sites
-                )
-                systems.append(system)
-                ids.append(system.system_id)
-            self.progress.update(1)
+    def get_sites(self, sid: int):
+        api_sites = self._call(
+            "getTrsSites",
+            sid=sid
+        )
+        return self.parse_sites(api_sites)
 
-        self.progress.close()
-        return Systems(systems)
+    def get_system(self, sid: int):
+        system_info = self._call(
+            "getTrsDetails",
+            sid=sid
+        )
+        sites = self.get_sites(sid)
+        talkgroups = self.get_talkgroups(sid)
+        return self.parse_system(sid, system_info, sites, talkgroups)
+
+    def get_county_info(self, ctid: int):
+        return self._call(
+            "getCountyInfo",
+            ctid=ctid
+        )
 
-    def get_all_agencies(self, stid: int):
-        state_info = self.service.getStateInfo(
-            authInfo=self.auth_info,
-            stid=stid
+    def get_counties(self, ctids: list[int]):
+        # ctid -> county name, one getCountiesByList call per batch; a batch that fails
+        # or leaves counties out falls back to getCountyInfo for each of them
+        counties = {}
+        for start in range(0, len(ctids), self.batch_size):
+            batch = ctids[start:start + self.batch_size]
+            try:
+                for county in self._call("getCountiesByList", request=[{"ctid": ctid} for ctid in batch]) or []:
+                    counties[county.ctid] = county.countyName
+            except (Fault, *RequestScheduler.TRANSIENT):
+                pass
+            for ctid in batch:
+                if ctid not in counties:
+                    counties[ctid] = self.get_county_info(ctid).countyName
+        return counties
+
+    def get_states(self, stids: list[int]):
+        # stid -> state name, batched the same way as get_counties
+        states = {}
+        for start in range(0, len(stids), self.batch_size):
+            batch = stids[start:start + self.batch_size]
+            try:
+                for state in self._call("getStatesByList", request=[{"stid": stid} for stid in batch]) or []:
+                    states[state.stid] = state.stateName
+            except (Fault, *RequestScheduler.TRANSIENT):
+                pass
+            for stid in batch:
+                if stid not in states:
+                    states[stid] = self._call("getStateInfo", stid=stid).stateName
+        return states
+
+    def get_agency_info(self, aid: int):
+        return self._call(
+            "getAgencyInfo",
+            aid=aid
         )
 
-        self.progress = tqdm(
-            desc="Progress",
-            total=len(state_info.countyList) + len(state_info.agencyList)
+    def get_agency(self, subcat_info: tuple):
+        subcat, agency_info, county_name = subcat_info
+        freqs = self._call(
+            "getSubcatFreqs",
+            scid=subcat.scid
         )
+        return self.parse_agency(subcat, agency_info, county_name, freqs)
 
-        counties = {0: state_info.stateName}
-        for county in state_info.countyList:
-            counties[county.ctid] = county.countyName
+    def _map(self, func, items: list):
+        # executor.map keeps results in the same order as items
+        if self.workers <= 1:
+            for item in items:
+                yield func(item)
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                yield from executor.map(func, items)
 
-        ids = []
-        subcats = []
-        for county in state_info.countyList:
-            county_info = self.service.getCountyInfo(
-                authInfo=self.auth_info,
-                ctid=county.ctid
-            )
-            if county_info.agencyList:
-                interval = 1 / len(county_info.agencyList)
-                for agency in county_info.agencyList:
-                    agency_info = self.service.getAgencyInfo(
-                        authInfo=self.auth_info,
-                        aid=agency.aid
-                    )
-                    if agency_info.cats:
-                        for cat in agency_info.cats:
-                            if cat.subcats:
-                                for subcat in cat.subcats:
-                                    if subcat.scid not in ids:
-                                        ids.append(subcat.scid)
-                                        subcats.append((subcat, counties[agency_info.ctid]))
-
-                    self.progress.update(interval)
-            else:
-                self.progress.update(1)
+    def get_crawl_plan(self, stid: int):
+        state_info = self._call(
+            "getStateInfo",
+            stid=stid
+        )
 
-        for agency in state_info.agencyList:
-            agency_info = self.service.getAgencyInfo(
-                authInfo=self.auth_info,
-                aid=agency.aid
-            )
-            if agency_info.cats:
-                for cat in agency_info.cats:
-                    if cat.subcats:
-                        for subcat in cat.subcats:
-                            if subcat.scid not in ids:
-                                ids.append(subcat.scid)
-                                subcats.append((subcat, counties[agency_info.ctid]))
+        self.progress = self.start_progress("counties", len(state_info.countyList))
 
+        county_infos = []
+        ctids = [county.ctid for county in state_info.countyList]
+        for county_info in self._map(self.get_county_info, ctids):
+            county_infos.append(county_info)
             self.progress.update(1)
 
         self.progress.close()
-        self.progress = tqdm(desc="Progress", total=len(subcats))
+        return CrawlPlan.from_api(stid, state_info, county_infos)
+
+    def get_all_systems(
+            self,
+            stid: int,
+            plan: CrawlPlan | None = None,
+            journal: Journal | None = None,
+            store: "SQLiteStore | None" = None
+    ):
+        if plan is None:
+            plan = self.get_crawl_plan(stid)
+
+        done = journal.systems if journal is not None else {}
+        sids = [sid for sid in plan.systems if sid not in done]
+        self.progress = self.start_progress("systems", len(plan.systems), len(plan.systems) - len(sids))
+
+        if store is not None:
+            for sid in plan.systems:
+                if sid in done:
+                    store.add_system(done[sid])
+
+        fetched = {}
+        for system in self._map(self.get_system, sids):
+            system.last_updated = plan.systems[system.system_id]
+            fetched[system.system_id] = system
+            if journal is not None:
+                journal.add_system(system)
+            if store is not None:
+                store.add_system(system)
+            self.progress.update(1)
 
-        agencies = []
-        for subcat, county_name in subcats:
-            freqs = self.service.getSubcatFreqs(
-                authInfo=self.auth_info,
-                scid=subcat.scid
-            )
-            agency_freqs = AgencyFreqs([])
-            if len(freqs) == 0:
-                self.progress.update(1)
-                interval = 0
-            else:
-                interval = 1 / len(freqs)
-            for freq in freqs:
-                if freq.out:
-                    mode = Mode(int(freq.mode))
-                    if mode == Mode.P25:
-                        self.progress.update(n=interval)
-                    elif mode == Mode.DMR:
-                        self.progress.update(n=interval)
-                    elif mode == Mode.NXDN48:
-                        self.progress.update(n=interval)
-                    elif mode == Mode.NXDN96:
-                        self.progress.update(n=interval)
-                    else:
-                        if freq.tone:
-                            if freq.tone.endswith(" PL"):
-                                tone_type = ToneType.CTCSS
-                                tone_value = float(freq.tone.replace("PL", ""))
-                            elif freq.tone.endswith("DPL"):
-                                tone_type = ToneType.DCS
-                                tone_value = float(freq.tone.replace("DPL", ""))
-                            else:
-                                tone_type = ToneType.NONE
-                                tone_value = 0
-                        else:
-                            tone_type = ToneType.NONE
-                            tone_value = 0
-
-                        tone = Tone(tone_type, tone_value)
-                        tag = Tag.convert_tag(int(freq.tags[0].tagId))
-
-                        agency_freq = AgencyFreq(
-                            name=freq.descr,
-                            freq=float(freq.out),
-                            tone=tone,
-                            mode=mode,
-                            tag=tag
-                        )
-                        agency_freqs.append(agency_freq)
-
-                        self.progress.update(n=interval)
-                else:
-                    self.progress.update(n=1)
+        self.progress.close()
+        return Systems([fetched[sid] if sid in fetched else done[sid] for sid in plan.systems])
 
-            agency = Agency(
-                agency_id=subcat.scid,
-                county_name=county_name,
-                agency_name=subcat.scName,
-                freqs=agency_freqs,
-            )
-            agencies.append(agency)
+    def get_agency_infos(self, plan: CrawlPlan):
+        self.progress = self.start_progress("agency_infos", len(plan.agencies))
 
-        return Agencies(agencies)
+        agency_infos = []
+        for agency_info in self._map(self.get_agency_info, plan.agencies):
+            agency_infos.append(agency_info)
+            self.progress.update(1)
+
+        self.progress.close()
+
+        missing = plan.missing_counties(agency_infos)
+        if missing:
+            plan.counties.update(self.get_counties(missing))
+        return agency_infos
+
+    def get_all_agencies(
+            self,
+            stid: int,
+            plan: CrawlPlan | None = None,
+            journal: Journal | None = None,
+            store: "SQLiteStore | None" = None
+    ):
+        if plan is None:
+            plan = self.get_crawl_plan(stid)
+
+        agency_infos = self.get_agency_infos(plan)
+        subcats = plan.subcats(agency_infos)
+
+        done = journal.agencies if journal is not None else {}
+        remaining = [item for item in subcats if item[0].scid not in done]
+        self.progress = self.start_progress("subcat_freqs", len(subcats), len(subcats) - len(remaining))
+
+        if store is not None:
+            for subcat, _, _ in subcats:
+                if subcat.scid in done:
+                    store.add_agency(done[subcat.scid])
+
+        fetched = {}
+        for agency in self._map(self.get_agency, remaining):
+            fetched[agency.agency_id] = agency
+            if journal is not None:
+                journal.add_agency(agency)
+            if store is not None:
+                store.add_agency(agency)
+            self.progress.update(1)
+
+        self.progress.close()
+        return Agencies([
+            fetched[subcat.scid] if subcat.scid in fetched else done[subcat.scid]
+            for subcat, _, _ in subcats
+        ])
 
     def get_database(self, filename: str, stid: int):
         if os.path.exists(filename):
             return Database.from_file(filename)
         else:
-            systems = self.get_all_systems(stid)
-            agencies = self.get_all_agencies(stid)
+            # a journal left over from an interrupted run lets the crawl pick up where it stopped
+            journal = Journal(filename + ".journal", stid)
+            try:
+                plan = self.get_crawl_plan(stid)
+                systems = self.get_all_systems(stid, plan, journal)
+                agencies = self.get_all_agencies(stid, plan, journal)
+            finally:
+                journal.close()
             db = Database(systems=systems, agencies=agencies)
             db.to_file(filename)
+            journal.remove()
+        return db
+
+    def get_tagged_freqs(self, operation: str, key: str, ids: list[int], tag_ids: list[int]):
+        # scid -> freqs, one call per county or agency and tag instead of one per subcat
+        calls = [{key: item_id, "tag": tag_id} for item_id in ids for tag_id in tag_ids]
+        self.progress = self.start_progress("tagged_freqs", len(calls))
+
+        grouped = defaultdict(list)
+        seen = set()
+        for freqs in self._map(lambda kwargs: self._call(operation, **kwargs), calls):
+            for freq in freqs or []:
+                # a freq carrying several of the requested tags comes back once for each
+                if freq.fid is not None:
+                    if freq.fid in seen:
+                        continue
+                    seen.add(freq.fid)
+                grouped[freq.scid].append(freq)
+            self.progress.update(1)
+
+        self.progress.close()
+        for freqs in grouped.values():
+            freqs.sort(key=lambda freq: (freq.sort is None, freq.sort or 0))
+        return grouped
+
+    def get_agencies_by_tag(
+            self,
+            stid: int,
+            tags: list[Tag],
+            plan: CrawlPlan | None = None,
+            counties: bool = True
+    ):
+        if plan is None:
+            plan = self.get_crawl_plan(stid)
+        tag_ids = Tag.tag_ids(tags)
+
+        # subcat names, counties and lastUpdated are only exposed through getAgencyInfo
+        agency_infos = self.get_agency_infos(plan)
+        freqs = self.get_tagged_freqs("getAgencyFreqsByTag", "aid", plan.agencies, tag_ids)
+
+        agencies = Agencies()
+        for subcat, agency_info, county_name in plan.subcats(agency_infos):
+            if subcat.scid in freqs:
+                agencies.append(self.parse_agency(subcat, agency_info, county_name, freqs[subcat.scid]))
+
+        if counties:
+            county_freqs = self.get_tagged_freqs("getCountyFreqsByTag", "ctid", list(plan.county_subcats), tag_ids)
+            ids = {agency.agency_id for agency in agencies}
+            for ctid, subcats in plan.county_subcats.items():
+                for subcat in subcats:
+                    if subcat.scid in county_freqs and subcat.scid not in ids:
+                        ids.add(subcat.scid)
+                        agencies.append(self.parse_subcat_agency(
+                            subcat,
+                            plan.counties[ctid],
+                            county_freqs[subcat.scid],
+                            None,
+                            plan.county_updated[ctid]
+                        ))
+        return agencies
+
+    def get_region_database(self, filename: str, stids: list[int], processes: int | None = None):
+        if os.path.exists(filename):
+            return Database.from_file(filename)
+
+        # one batched lookup catches a bad state id before any process starts crawling
+        self.get_states(stids)
+
+        # every process gets the same scheduler, with an equal share of the rate limit
+        processes = min(processes or os.cpu_count() or 1, len(stids))
+        scheduler = self.scheduler.settings()
+        if scheduler["rate"] is not None:
+            scheduler["rate"] /= processes
+            scheduler["burst"] = max(1, scheduler["burst"] // processes)
+
+        crawl = partial(
+            _get_state_database,
+            self.username,
+            self.password,
+            self.workers,
+            self.cache.filename if self.cache is not None else None,
+            scheduler,
+            self.batch_size,
+            self.progress_hook,
+            self.address,
+            filename
+        )
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            databases = list(executor.map(crawl, stids))
+
+        db = Database.merge(databases)
+        db.to_file(filename)
+        for stid in stids:
+            journal_filename = f"{filename}.{stid}.journal"
+            if os.path.exists(journal_filename):
+                os.remove(journal_filename)
+        return db
+
+    def update_file(self, filename: str, stid: int):
+        if not os.path.exists(filename):
+            return self.get_database(filename, stid)
+
+        db = Database.from_file(filename)
+        plan = self.get_crawl_plan(stid)
+
+        existing = {system.system_id: system for system in db.systems}
+        stale = []
+        for sid, last_updated in plan.systems.items():
+            system = existing.get(sid)
+            if system is None or system.last_updated is None or system.last_updated != last_updated:
+                stale.append(sid)
+
+        self.progress = self.start_progress("systems", len(stale))
+        for system in self._map(self.get_system, stale):
+            system.last_updated = plan.systems[system.system_id]
+            existing[system.system_id] = system
+            self.progress.update(1)
+        self.progress.close()
+
+        systems = Systems([existing[sid] for sid in plan.systems])
+
+        # agencies only expose lastUpdated through getAgencyInfo
+        agency_infos = self.get_agency_infos(plan)
+        subcats = plan.subcats(agency_infos)
+
+        existing = {agency.agency_id: agency for agency in db.agencies}
+        stale = []
+        for subcat, agency_info, county_name in subcats:
+            agency = existing.get(subcat.scid)
+            last_updated = self.parse_timestamp(agency_info.lastUpdated)
+            if agency is None or agency.last_updated is None or agency.last_updated != last_updated:
+                stale.append((subcat, agency_info, county_name))
+
+        self.progress = self.start_progress("subcat_freqs", len(stale))
+        for agency in self._map(self.get_agency, stale):
+            existing[agency.agency_id] = agency
+            self.progress.update(1)
+        self.progress.close()
+
+        agencies = Agencies([existing[subcat.scid] for subcat, _, _ in subcats])
+
+        db = Database(systems=systems, agencies=agencies)
+        db.to_file(filename)
         return db
 
     @staticmethod
     def near_point(db: Database, lat1: float, lon1: float, radius: float = 10):
-        x1 = lat1 * 69
-        y1 = math.cos(lon1) * 69
+        matches = {}
+        for distance, system, site in db.site_index.radius(lat1, lon1, radius):
+            matches.setdefault(system.system_id, set()).add(id(site))
 
         new_db = replace(db)
         new_db.systems = []
 
         for system in db.systems:
+            if system.system_id not in matches:
+                continue
+
             new_system = replace(system)
             new_system.sites = []
 
             for site in system.sites:
-                lat2, lon2 = site.lat, site.long
+                if id(site) in matches[system.system_id]:
+                    new_system.sites.append(site)
 
-                x2 = lat2 * 69
-                y2 = math.cos(lon2) * 69
+            new_db.systems.append(new_system)
 
-                # slope = (y2 - y1) / (x2 - x1)
-                distance = math.sqrt(((y2 - y1) ** 2) + ((x2 - x1) ** 2))
+        return new_db
 
-                if distance < radius:
-                    new_system.sites.append(site)
-                    print(site.name)
+    @staticmethod
+    def near_point_file(filename: str, lat1: float, lon1: float, radius: float = 10):
+        systems = Systems()
+        for system in Database.iter_systems(filename):
+            sites = Sites(
+                site for site in system.sites
+                if SiteIndex.distance(lat1, lon1, site.lat, site.long) <= radius
+            )
+            if sites:
+                new_system = replace(system)
+                new_system.sites = sites
+                systems.append(new_system)
 
-            if len(new_system.sites) > 0:
-                new_db.systems.append(new_system)
+        db = Database.stream(filename)
+        db.systems = systems
+        return db
 
-        return new_db
+    @staticmethod
+    def coverage(
+            db: Database,
+            receivers: list[tuple[float, float]],
+            radius: float | None = None,
+            limit: int | None = None
+    ):
+        return db.site_arrays.coverage(receivers, radius, limit)
 
+    @staticmethod
+    def sdrtrunk_talkgroup_alias(system: System, talkgroup: Talkgroup):
+        attrib = {
+            "color": "0",
+            "group": talkgroup.tg_tag.value,
+            "list": system.name,
+            "name": talkgroup.tg_name
+        }
+        alias = ET.Element("alias", attrib)
+        attrib = {
+            "type": "talkgroup",
+            "protocol": "APCO25",
+            "value": str(talkgroup.tg_id)
+        }
+        ET.SubElement(alias, "id", attrib)
+        return alias
 
     @staticmethod
-    def export_sdrtrunk(db: Database, filename: str):
-        playlist = ET.Element("playlist", {"version": "4"})
-        for system in db.systems:
-            for talkgroup in system.talkgroups:
-                attrib = {
-                    "color": "0",
-                    "group": talkgroup.tg_tag.value,
-                    "list": system.name,
-                    "name": talkgroup.tg_name
-                }
-                alias = ET.SubElement(playlist, "alias", attrib)
-                attrib = {
-                    "type": "talkgroup",
-                    "protocol": "APCO25",
-                    "value": str(talkgroup.tg_id)
-                }
-                ET.SubElement(alias, "id", attrib)
+    def sdrtrunk_site_channel(system: System, site: Site):
+        if len(site.control) == 0:
+            return None
+        if system.modulation != Modulation.P25_P1 and system.modulation != Modulation.P25_P2:
+            return None
+        attrib = {
+            "system": system.name,
+            "site": site.name,
+            "name": "Control Channels",
+            "order": "0",
+            "enabled": "false"
+        }
+        channel = ET.Element("channel", attrib)
 
-        for system in db.systems:
-            for site in system.sites:
-                if len(site.control) == 0:
-                    continue
-                if system.modulation != Modulation.P25_P1 and system.modulation != Modulation.P25_P2:
-                    continue
-                attrib = {
-                    "system": system.name,
-                    "site": site.name,
-                    "name": "Control Channels",
-                    "order": "0",
-                    "enabled": "false"
-                }
-                channel = ET.SubElement(playlist, "channel", attrib)
+        log_config = ET.SubElement(channel, "event_log_configuration")
+        log_msg = ET.SubElement(log_config, "logger")
+        log_msg.text = "DECODED_MESSAGE"
 
-                log_config = ET.SubElement(channel, "event_log_configuration")
-                log_msg = ET.SubElement(log_config, "logger")
-                log_msg.text = "DECODED_MESSAGE"
+        ET.SubElement(channel, "aux_decode_configuration")
+        ET.SubElement(channel, "record_configuration")
 
-                ET.SubElement(channel, "aux_decode_configuration")
-                ET.SubElement(channel, "record_configuration")
-
-                if len(site.control) > 1:
-                    attrib = {
-                        "type": "sourceConfigTunerMultipleFrequency",
-                        "frequency_rotation_delay": "400",
-                        "source_type": "TUNER_MULTIPLE_FREQUENCIES"
-                    }
-                else:
-                    attrib = {
-                        "type": "sourceConfigTuner",
-                        "frequency": str(int(site.control[0] * 1e6)),
-                        "source_type": "TUNER"
-                    }
-
-                source_config = ET.SubElement(channel, "source_configuration", attrib)
-
-                if len(site.control) > 1:
-                    for freq in site.control:
-                        frequency = ET.SubElement(source_config, "frequency")
-                        frequency.text = str(int(freq * 1e6))
-
-                if system.modulation == Modulation.P25_P1:
-                    attrib = {
-                        "type": "decodeConfigP25Phase1",
-                        "modulation": "C4FM",
-                        "traffic_channel_pool_size": "20",
-                        "ignore_data_calls": "false"
-                    }
-                elif system.modulation == Modulation.P25_P2:
-                    attrib = {
-                        "type": "decodeConfigP25Phase2",
-                        "auto_detect_scramble_parameters": "true",
-                        "traffic_channel_pool_size": "20",
-                        "ignore_data_calls": "false"
-                    }
-                else:
-                    attrib = {}
+        if len(site.control) > 1:
+            attrib = {
+                "type": "sourceConfigTunerMultipleFrequency",
+                "frequency_rotation_delay": "400",
+                "source_type": "TUNER_MULTIPLE_FREQUENCIES"
+            }
+        else:
+            attrib = {
+                "type": "sourceConfigTuner",
+                "frequency": str(int(site.control[0] * 1e6)),
+                "source_type": "TUNER"
+            }
+
+        source_config = ET.SubElement(channel, "source_configuration", attrib)
+
+        if len(site.control) > 1:
+            for freq in site.control:
+                frequency = ET.SubElement(source_config, "frequency")
+                frequency.text = str(int(freq * 1e6))
+
+        if system.modulation == Modulation.P25_P1:
+            attrib = {
+                "type": "decodeConfigP25Phase1",
+                "modulation": "C4FM",
+                "traffic_channel_pool_size": "20",
+                "ignore_data_calls": "false"
+            }
+        elif system.modulation == Modulation.P25_P2:
+            attrib = {
+                "type": "decodeConfigP25Phase2",
+                "auto_detect_scramble_parameters": "true",
+                "traffic_channel_pool_size": "20",
+                "ignore_data_calls": "false"
+            }
+        else:
+            attrib = {}
 
-                ET.SubElement(channel, "decode_configuration", attrib)
+        ET.SubElement(channel, "decode_configuration", attrib)
 
-                alias_list = ET.SubElement(channel, "alias_list_name")
-                alias_list.text = system.name
+        alias_list = ET.SubElement(channel, "alias_list_name")
+        alias_list.text = system.name
+        return channel
 
-        i = 1
-        for agency in db.agencies:
-            for freq in agency.freqs:
-                if freq.mode not in [Mode.FM, Mode.FMN, Mode.AM]:
-                    continue
+    @staticmethod
+    def sdrtrunk_freq_alias(freq: AgencyFreq, i: int):
+        attrib = {
+            "color": "0",
+            "group": freq.tag.value,
+            "list": "Agencies",
+            "name": freq.name
+        }
+        alias = ET.Element("alias", attrib)
 
-                attrib = {
-                    "color": "0",
-                    "group": freq.tag.value,
-                    "list": "Agencies",
-                    "name": freq.name
-                }
-                alias = ET.SubElement(playlist, "alias", attrib)
+        attrib = {
+            "type": "talkgroup",
+            "value": str(i),
+            "protocol": "NBFM" if freq.mode in [Mode.FM, Mode.FMN] else "AM"
+        }
+        ET.SubElement(alias, "id", attrib)
 
+        if freq.mode == Mode.FM or freq.mode == Mode.FMN:
+            if freq.tone.tone_type == ToneType.DCS:
                 attrib = {
-                    "type": "talkgroup",
-                    "value": str(i),
-                    "protocol": "NBFM" if freq.mode in [Mode.FM, Mode.FMN] else "AM"
+                    "type": "dcs",
+                    "code": f"N{int(freq.tone.tone_value):03d}"
                 }
                 ET.SubElement(alias, "id", attrib)
+        return alias
 
-                if freq.mode == Mode.FM or freq.mode == Mode.FMN:
-                    if freq.tone.tone_type == ToneType.DCS:
-                        attrib = {
-                            "type": "dcs",
-                            "code": f"N{int(freq.tone.tone_value):03d}"
-                        }
-                        ET.SubElement(alias, "id", attrib)
+    @staticmethod
+    def sdrtrunk_freq_channel(agency: Agency, freq: AgencyFreq, i: int):
+        attrib = {
+            "system": agency.county_name,
+            "site": agency.agency_name,
+            "name": freq.name,
+            "order": "1",
+            "enabled": "false"
+        }
+        channel = ET.Element("channel", attrib)
 
-                i += 1
+        if freq.mode == Mode.FM or freq.mode == Mode.FMN:
+            if freq.tone.tone_type == ToneType.DCS:
+                aux_config = ET.SubElement(channel, "aux_decode_configuration")
+                aux_decode = ET.SubElement(aux_config, "aux_decoder")
+                aux_decode.text = "DCS"
+            else:
+                ET.SubElement(channel, "aux_decode_configuration")
+        else:
+            ET.SubElement(channel, "aux_decode_configuration")
 
-        i = 1
-        for agency in db.agencies:
-            for freq in agency.freqs:
-                if freq.mode not in [Mode.FM, Mode.FMN, Mode.AM]:
-                    continue
+        ET.SubElement(channel, "record_configuration")
+        ET.SubElement(channel, "event_log_configuration")
 
-                attrib = {
-                    "system": agency.county_name,
-                    "site": agency.agency_name,
-                    "name": freq.name,
-                    "order": "1",
-                    "enabled": "false"
-                }
-                channel = ET.SubElement(playlist, "channel", attrib)
-
-                if freq.mode == Mode.FM or freq.mode == Mode.FMN:
-                    if freq.tone.tone_type == ToneType.DCS:
-                        aux_config = ET.SubElement(channel, "aux_decode_configuration")
-                        aux_decode = ET.SubElement(aux_config, "aux_decoder")
-                        aux_decode.text = "DCS"
-                    else:
-                        ET.SubElement(channel, "aux_decode_configuration")
-                else:
-                    ET.SubElement(channel, "aux_decode_configuration")
+        attrib = {
+            "type": "sourceConfigTuner",
+            "frequency": str(int(freq.freq * 1e6)),
+            "source_type": "TUNER"
+        }
+        ET.SubElement(channel, "source_configuration", attrib)
+
+        alias_list = ET.SubElement(channel, "alias_list_name")
+        alias_list.text = "Agencies"
+
+        if freq.mode == Mode.FM or freq.mode == Mode.FMN:
+            attrib = {
+                "type": "decodeConfigNBFM",
+                "audioFilter": "true",
+                "bandwidth": "BW_12_5",
+                "squelch": "-78",
+                "autoTrack": "true",
+                "talkgroup": str(i)
+            }
+        elif freq.mode == Mode.AM:
+            attrib = {
+                "type": "decodeConfigAM",
+                "bandwidth": "BW_15_0",
+                "squelch": "-78",
+                "autoTrack": "true",
+                "talkgroup": str(i)
+            }
+        else:
+            attrib = {}
 
-                ET.SubElement(channel, "record_configuration")
-                ET.SubElement(channel, "event_log_configuration")
+        ET.SubElement(channel, "decode_configuration", attrib)
+        return channel
 
-                attrib = {
-                    "type": "sourceConfigTuner",
-                    "frequency": str(int(freq.freq * 1e6)),
-                    "source_type": "TUNER"
-                }
-                ET.SubElement(channel, "source_configuration", attrib)
-
-                alias_list = ET.SubElement(channel, "alias_list_name")
-                alias_list.text = "Agencies"
-
-                if freq.mode == Mode.FM or freq.mode == Mode.FMN:
-                    attrib = {
-                        "type": "decodeConfigNBFM",
-                        "audioFilter": "true",
-                        "bandwidth": "BW_12_5",
-                        "squelch": "-78",
-                        "autoTrack": "true",
-                        "talkgroup": str(i)
-                    }
-                elif freq.mode == Mode.AM:
-                    attrib = {
-                        "type": "decodeConfigAM",
-                        "bandwidth": "BW_15_0",
-                        "squelch": "-78",
-                        "autoTrack": "true",
-                        "talkgroup": str(i)
-                    }
-                else:
-                    attrib = {}
+    @staticmethod
+    def export(db: Database, writers: list[ExportWriter]):
+        # one pass over the database feeds every writer
+        with ExitStack() as stack:
+            writers = [stack.enter_context(writer) for writer in writers]
+            for system in db.systems:
+                for writer in writers:
+                    writer.system(system)
+            for agency in db.agencies:
+                for writer in writers:
+                    writer.agency(agency)
 
-                ET.SubElement(channel, "decode_configuration", attrib)
+    @staticmethod
+    def export_sdrtrunk(db: Database, filename: str, stream: bool = False, cache: str | None = None):
+        # with a fragment cache only changed systems and agencies are rendered, and edits made in sdrtrunk are kept
+        if cache is not None:
+            writer = IncrementalSDRTrunkWriter(filename, cache)
+        else:
+            writer = SDRTrunkWriter(filename, stream)
+        RadioReferenceAPI.export(db, [writer])
+        return writer
 
-                i += 1
+    @staticmethod
+    def export_op25(db: Database, directory: str):
+        RadioReferenceAPI.export(db, [OP25Writer(directory)])
+
+
+class AsyncRadioReferenceAPI(AsyncClient):
+    def __init__(
+            self,
+            username: str,
+            password: str,
+            concurrency: int = 8,
+            cache: ResponseCache | None = None,
+            transport: AsyncTransport | None = None,
+            scheduler: AsyncRequestScheduler | None = None,
+            batch_size: int = 100,
+            metrics: Metrics | None = None,
+            address: str | None = None
+    ):
+        settings = Settings(strict=False)
+        if transport is None:
+            transport = AsyncPooledTransport(concurrency=concurrency)
+        super().__init__(wsdl=_load_wsdl(settings), settings=settings, transport=transport)
+        if address is not None:
+            self._default_service = AsyncServiceProxy(self, next(iter(self.wsdl.bindings.values())), address=address)
+        self.address = address
+        self.username = username
+        self.password = password
+        self.auth_info = {
+            'appKey': '88969092',
+            'username': self.username,
+            'password': self.password,
+            'version': 'latest',
+            'style': 'rpc'
+        }
+        self.cache = cache
+        self.scheduler = scheduler if scheduler is not None else AsyncRequestScheduler(max_concurrency=concurrency)
+        self.batch_size = batch_size
+        self.metrics = metrics if metrics is not None else Metrics()
+        if isinstance(self.transport, TransportStats):
+            self.transport.metrics = self.metrics
+
+    async def _request(self, operation: str, **kwargs):
+        start = time.monotonic()
+        try:
+            response = await self.service[operation](authInfo=self.auth_info, **kwargs)
+        except BaseException:
+            self.metrics.observe_call(operation, time.monotonic() - start, False)
+            raise
+        self.metrics.observe_call(operation, time.monotonic() - start)
+        return response
+
+    async def _call(self, operation: str, **kwargs):
+        if self.cache is not None:
+            response = self.cache.get(operation, kwargs)
+            if response is not ResponseCache.MISS:
+                self.metrics.observe_cached(operation)
+                return response
+
+        response = await self.scheduler.call(
+            partial(self._request, operation, **kwargs),
+            idempotent=operation.startswith("get")
+        )
+        if self.cache is not None:
+            self.cache.put(operation, kwargs, response)
+        return response
+
+    async def get_talkgroups(self, sid: int):
+        tgs = await self._call(
+            "getTrsTalkgroups",
+            sid=sid,
+            tgCid=xsd.Nil,
+            tgTag=xsd.Nil,
+            tgDec=xsd.Nil
+        )
+        return RadioReferenceAPI.parse_talkgroups(tgs)
+
+    async def get_sites(self, sid: int):
+        api_sites = await self._call("getTrsSites", sid=sid)
+        return RadioReferenceAPI.parse_sites(api_sites)
+
+    async def get_system(self, sid: int):
+        system_info, sites, talkgroups = await asyncio.gather(
+            self._call("getTrsDetails", sid=sid),
+            self.get_sites(sid),
+            self.get_talkgroups(sid)
+        )
+        return RadioReferenceAPI.parse_system(sid, system_info, sites, talkgroups)
+
+    async def get_county_info(self, ctid: int):
+        return await self._call("getCountyInfo", ctid=ctid)
+
+    async def get_counties(self, ctids: list[int]):
+        batches = [ctids[start:start + self.batch_size] for start in range(0, len(ctids), self.batch_size)]
+        responses = await asyncio.gather(
+            *(self._call("getCountiesByList", request=[{"ctid": ctid} for ctid in batch]) for batch in batches),
+            return_exceptions=True
+        )
+
+        counties = {}
+        for response in responses:
+            if isinstance(response, (Fault, *RequestScheduler.TRANSIENT)):
+                continue
+            if isinstance(response, BaseException):
+                raise response
+            for county in response or []:
+                counties[county.ctid] = county.countyName
+
+        missing = [ctid for ctid in ctids if ctid not in counties]
+        for ctid, county_info in zip(missing, await asyncio.gather(*(self.get_county_info(ctid) for ctid in missing))):
+            counties[ctid] = county_info.countyName
+        return counties
+
+    async def get_crawl_plan(self, stid: int):
+        state_info = await self._call("getStateInfo", stid=stid)
+        with self.metrics.phase("counties"):
+            county_infos = await asyncio.gather(
+                *(self.get_county_info(county.ctid) for county in state_info.countyList)
+            )
+        return CrawlPlan.from_api(stid, state_info, county_infos)
+
+    async def get_all_systems(self, stid: int, plan: CrawlPlan | None = None):
+        if plan is None:
+            plan = await self.get_crawl_plan(stid)
+
+        with self.metrics.phase("systems"):
+            systems = await asyncio.gather(*(self.get_system(sid) for sid in plan.systems))
+        for system in systems:
+            system.last_updated = plan.systems[system.system_id]
+        return Systems(systems)
+
+    async def get_all_agencies(self, stid: int, plan: CrawlPlan | None = None):
+        if plan is None:
+            plan = await self.get_crawl_plan(stid)
+
+        with self.metrics.phase("agency_infos"):
+            agency_infos = await asyncio.gather(
+                *(self._call("getAgencyInfo", aid=aid) for aid in plan.agencies)
+            )
+        missing = plan.missing_counties(agency_infos)
+        if missing:
+            plan.counties.update(await self.get_counties(missing))
+        subcats = plan.subcats(agency_infos)
+
+        with self.metrics.phase("subcat_freqs"):
+            freqs = await asyncio.gather(
+                *(self._call("getSubcatFreqs", scid=subcat.scid) for subcat, _, _ in subcats)
+            )
+
+        agencies = []
+        for (subcat, agency_info, county_name), subcat_freqs in zip(subcats, freqs):
+            agencies.append(
+                RadioReferenceAPI.parse_agency(subcat, agency_info, county_name, subcat_freqs)
+            )
+        return Agencies(agencies)
+
+    async def get_database(self, filename: str, stid: int):
+        if os.path.exists(filename):
+            return Database.from_file(filename)
+
+        plan = await self.get_crawl_plan(stid)
+        systems, agencies = await asyncio.gather(
+            self.get_all_systems(stid, plan),
+            self.get_all_agencies(stid, plan)
+        )
+        db = Database(systems=systems, agencies=agencies)
+        db.to_file(filename)
+        return db
 
-        xml = parseString(ET.tostring(playlist))
-        xml = xml.toprettyxml()
-        with open(filename, "w") as f:
-            f.write(xml)
 
+def _get_state_database(
+        username: str,
+        password: str,
+        workers: int,
+        cache_filename: str | None,
+        scheduler: dict,
+        batch_size: int,
+        progress_hook,
+        address: str | None,
+        filename: str,
+        stid: int
+):
+    cache = ResponseCache(cache_filename) if cache_filename is not None else None
+    journal = Journal(f"{filename}.{stid}.journal", stid)
+    rrapi = RadioReferenceAPI(
+        username,
+        password,
+        workers=workers,
+        cache=cache,
+        scheduler=RequestScheduler(**scheduler),
+        batch_size=batch_size,
+        progress_hook=progress_hook,
+        address=address
+    )
+    try:
+        plan = rrapi.get_crawl_plan(stid)
+        systems = rrapi.get_all_systems(stid, plan, journal)
+        agencies = rrapi.get_all_agencies(stid, plan, journal)
+    finally:
+        journal.close()
+        if cache is not None:
+            cache.close()
+    return Database(systems=systems, agencies=agencies)
 
 def main():
     # rrapi = RadioReferenceAPI("username", "password")
     # systems = rrapi.get_all_systems(37)
     # systems.to_file("systems.json")
-    # rrapi.update_file("systems.json")
+    # rrapi.update_file("db.json", 37)
     # systems = Systems.from_file("systems.json")
     # rrapi.export_sdrtrunk(systems, "config.xml")
     # agencies = rrapi.get_all_agencies(37)
@@ -979,6 +3966,7 @@ def main():
     #     print(system.name)
     #     for site in system.sites:
     #         print(site.name)
+    pass
 
 if __name__ == "__main__":
     main()
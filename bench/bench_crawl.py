@@ -0,0 +1,100 @@
+from mock_server import MockServer, SyntheticRegion
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import ProgressHook, RadioReferenceAPI, RequestScheduler # noqa
+
+
+def run(server: MockServer, name: str, workers: int, func):
+    server.reset()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    calls = sum(server.calls.values())
+    return {
+        "benchmark": name,
+        "workers": workers,
+        "seconds": elapsed,
+        "calls": calls,
+        "faults": sum(server.faults.values()),
+        "calls_per_second": calls / elapsed if elapsed else 0.0
+    }
+
+
+def bench(server: MockServer, stid: int, workers: int, repeat: int):
+    rrapi = RadioReferenceAPI(
+        "bench",
+        "bench",
+        workers=workers,
+        scheduler=RequestScheduler(max_concurrency=workers, backoff=0.05),
+        progress_hook=ProgressHook,
+        address=server.url
+    )
+    plan = rrapi.get_crawl_plan(stid)
+
+    results = []
+    for _ in range(repeat):
+        results.append(run(server, "get_all_systems", workers, lambda: rrapi.get_all_systems(stid, plan)))
+        results.append(run(server, "get_all_agencies", workers, lambda: rrapi.get_all_agencies(stid, plan)))
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "db.json")
+            results.append(run(server, "get_database", workers, lambda: rrapi.get_database(filename, stid)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time crawls against the local mock SOAP server")
+    parser.add_argument("--workers", default="1,4,8", help="comma separated worker counts")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--counties", type=int, default=20)
+    parser.add_argument("--systems", type=int, default=2)
+    parser.add_argument("--sites", type=int, default=4)
+    parser.add_argument("--talkgroups", type=int, default=200)
+    parser.add_argument("--agencies", type=int, default=3)
+    parser.add_argument("--subcats", type=int, default=4)
+    parser.add_argument("--freqs", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    stid = 37
+    region = SyntheticRegion(
+        [stid],
+        counties=args.counties,
+        systems=args.systems,
+        sites=args.sites,
+        talkgroups=args.talkgroups,
+        agencies=args.agencies,
+        subcats=args.subcats,
+        freqs=args.freqs
+    )
+    print(f"Region {region.stats()}, latency {args.latency}s, fault rate {args.fault_rate}")
+
+    results = []
+    with MockServer(region, latency=args.latency, jitter=args.jitter, fault_rate=args.fault_rate) as server:
+        for workers in [int(workers) for workers in args.workers.split(",")]:
+            results.extend(bench(server, stid, workers, args.repeat))
+
+    print(f"{'benchmark':<18}{'workers':>8}{'seconds':>10}{'calls':>8}{'faults':>8}{'calls/s':>10}")
+    for result in results:
+        print(
+            f"{result['benchmark']:<18}{result['workers']:>8}{result['seconds']:>10.3f}"
+            f"{result['calls']:>8}{result['faults']:>8}{result['calls_per_second']:>10.1f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"region": region.stats(), "args": vars(args), "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import ( # noqa
+    Agencies,
+    Agency,
+    AgencyFreq,
+    AgencyFreqs,
+    Database,
+    Mode,
+    Modulation,
+    OP25Writer,
+    RadioReferenceAPI,
+    SDRTrunkWriter,
+    Site,
+    SiteIndex,
+    Sites,
+    System,
+    Systems,
+    Tag,
+    Talkgroup,
+    Talkgroups,
+    Tone,
+    ToneType
+)
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# per system and per agency counts are averages, the generator varies them around it
+SCALES = {
+    "small": {"systems": 50, "talkgroups": 200, "sites": 6, "agencies": 200, "freqs": 8},
+    "state": {"systems": 300, "talkgroups": 400, "sites": 8, "agencies": 2000, "freqs": 10},
+    "nation": {"systems": 4000, "talkgroups": 500, "sites": 8, "agencies": 8000, "freqs": 6}
+}
+
+# continental us
+MIN_LAT, MAX_LAT = 24.5, 49.0
+MIN_LONG, MAX_LONG = -124.7, -67.0
+
+
+def generate_database(
+        systems: int,
+        talkgroups: int,
+        sites: int,
+        agencies: int,
+        freqs: int,
+        seed: int = 1
+):
+    r = random.Random(seed)
+    tags = list(Tag)
+    modulations = [Modulation.P25_P1, Modulation.P25_P2, Modulation.DMR, Modulation.NXDN]
+    modes = [Mode.FM, Mode.FM, Mode.FMN, Mode.P25, Mode.AM, Mode.DMR]
+    counties = [f"County {i}" for i in range(3000)]
+
+    db_systems = Systems()
+    for system_id in range(1, systems + 1):
+        lat = r.uniform(MIN_LAT, MAX_LAT)
+        long = r.uniform(MIN_LONG, MAX_LONG)
+
+        system_sites = Sites()
+        for i in range(r.randint(1, sites * 2 - 1)):
+            system_sites.append(Site(
+                name=f"Site {system_id}-{i + 1}",
+                site_id=i + 1,
+                control=[round(r.uniform(851, 860), 5) for _ in range(r.randint(1, 3))],
+                channels=[round(r.uniform(851, 860), 5) for _ in range(r.randint(2, 10))],
+                lat=round(lat + r.uniform(-0.75, 0.75), 5),
+                long=round(long + r.uniform(-0.75, 0.75), 5),
+                range=round(r.uniform(5, 40), 1)
+            ))
+
+        system_talkgroups = Talkgroups(
+            Talkgroup(tg_id, f"Talkgroup {tg_id} {system_id}", r.choice(tags))
+            for tg_id in range(1, r.randint(talkgroups // 4, talkgroups * 7 // 4) + 1)
+        )
+
+        db_systems.append(System(
+            name=f"System {system_id}",
+            system_id=system_id,
+            modulation=r.choice(modulations),
+            talkgroups=system_talkgroups,
+            sites=system_sites,
+            last_updated="2024-01-01T00:00:00"
+        ))
+
+    db_agencies = Agencies()
+    for agency_id in range(1, agencies + 1):
+        agency_freqs = AgencyFreqs()
+        for i in range(r.randint(1, freqs * 2 - 1)):
+            tone_type = r.choice(list(ToneType))
+            tone_value = {ToneType.NONE: 0.0, ToneType.CTCSS: 123.0, ToneType.DCS: 23.0}[tone_type]
+            agency_freqs.append(AgencyFreq(
+                name=f"Frequency {agency_id}-{i}",
+                tone=Tone(tone_type, tone_value),
+                freq=round(r.uniform(30, 470), 4),
+                tag=r.choice(tags),
+                mode=r.choice(modes)
+            ))
+
+        db_agencies.append(Agency(
+            agency_id=agency_id,
+            county_name=r.choice(counties),
+            agency_name=f"Agency {agency_id}",
+            freqs=agency_freqs,
+            parent_id=agency_id // 4 + 1,
+            last_updated="2024-01-01T00:00:00"
+        ))
+
+    return Database(systems=db_systems, agencies=db_agencies)
+
+
+def describe(db: Database):
+    return {
+        "systems": len(db.systems),
+        "sites": sum(len(system.sites) for system in db.systems),
+        "talkgroups": sum(len(system.talkgroups) for system in db.systems),
+        "agencies": len(db.agencies),
+        "freqs": sum(len(agency.freqs) for agency in db.agencies)
+    }
+
+
+def benchmarks(db: Database, directory: str, queries: int, radius: float, seed: int = 1):
+    json_file = os.path.join(directory, "db.json")
+    binary_file = os.path.join(directory, "db.bin")
+    xml_file = os.path.join(directory, "playlist.xml")
+    op25_directory = os.path.join(directory, "op25")
+    incremental_file = os.path.join(directory, "incremental.xml")
+    cache_file = os.path.join(directory, "fragments.db")
+
+    # the load benchmarks read what the save benchmarks write, the incremental export reruns on a warm
+    # fragment cache and queries hit random sites
+    db.to_file(json_file)
+    db.to_binary(binary_file)
+    RadioReferenceAPI.export_sdrtrunk(db, incremental_file, cache=cache_file)
+    all_sites = [site for system in db.systems for site in system.sites]
+    points = [(site.lat, site.long) for site in random.Random(seed).choices(all_sites, k=queries)]
+
+    def near_point():
+        db.site_index
+        for lat, long in points:
+            RadioReferenceAPI.near_point(db, lat, long, radius)
+
+    return {
+        "save_json": lambda: db.to_file(json_file),
+        "load_json": lambda: Database.from_file(json_file),
+        "save_binary": lambda: db.to_binary(binary_file),
+        "load_binary": lambda: Database.from_binary(binary_file),
+        "site_index": lambda: SiteIndex.build(db),
+        "near_point": near_point,
+        "export_sdrtrunk": lambda: RadioReferenceAPI.export_sdrtrunk(db, xml_file, stream=True),
+        "export_sdrtrunk_pretty": lambda: RadioReferenceAPI.export_sdrtrunk(db, xml_file),
+        "export_sdrtrunk_incremental": lambda: RadioReferenceAPI.export_sdrtrunk(db, incremental_file, cache=cache_file),
+        "export_op25": lambda: RadioReferenceAPI.export_op25(db, op25_directory),
+        "export_all": lambda: RadioReferenceAPI.export(db, [
+            SDRTrunkWriter(xml_file, stream=True),
+            OP25Writer(op25_directory)
+        ])
+    }
+
+
+def measure(func, repeat: int, memory: bool):
+    # best of repeat for time, memory is measured in a separate run since tracing slows everything down
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_bytes": peak}
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ("seconds", "peak_bytes"):
+            old = baseline[name].get(key)
+            new = result.get(key)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.append((name, key, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and measure the offline database pipeline")
+    parser.add_argument("--scale", choices=SCALES, default="state")
+    for key in SCALES["state"]:
+        parser.add_argument(f"--{key}", type=int, help=f"override the {key} count of the scale")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help="comma separated benchmark names")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--queries", type=int, default=100, help="near_point queries per run")
+    parser.add_argument("--radius", type=float, default=25)
+    parser.add_argument("--baseline", default=BASELINES, help="baseline file, keyed by scale")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown or growth before failing")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    # overridden sizes get their own baseline entry
+    scale = args.scale if sizes == SCALES[args.scale] else "-".join(f"{key}{value}" for key, value in sizes.items())
+
+    start = time.perf_counter()
+    db = generate_database(**sizes, seed=args.seed)
+    print(f"Generated {describe(db)} in {time.perf_counter() - start:.1f}s")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        funcs = benchmarks(db, directory, args.queries, args.radius, args.seed)
+        names = args.only.split(",") if args.only else list(funcs)
+        for name in names:
+            results[name] = measure(funcs[name], args.repeat, not args.no_memory)
+            peak = results[name]["peak_bytes"]
+            print(f"{name:<30}{results[name]['seconds']:>10.3f}s" + (f"{peak / 2 ** 20:>10.1f} MiB" if peak else ""))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baselines = json.load(f)
+
+    regressions = compare(results, baselines.get(scale, {}), args.tolerance)
+    for name, key, old, new in regressions:
+        print(f"Regression in {name} {key}: {old:.6g} -> {new:.6g}")
+
+    if args.save_baseline:
+        baselines.setdefault(scale, {}).update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=4)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "scale": scale,
+                "database": describe(db),
+                "python": platform.python_version(),
+                "results": results
+            }, f, indent=4)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
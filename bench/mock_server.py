@@ -0,0 +1,497 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from functools import lru_cache
+from lxml import etree
+
+import argparse
+import gzip
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import WSDL # noqa
+
+SOAP_ENV = "http://schemas.xmlsoap.org/soap/envelope/"
+XSI = "http://www.w3.org/2001/XMLSchema-instance"
+TNS = "http://api.radioreference.com/soap2"
+WSDL_NS = "http://schemas.xmlsoap.org/wsdl/"
+
+TIMESTAMP = "2024-01-{:02d}T00:00:00"
+
+
+def load_operations(filename: str = WSDL):
+    # operation name -> input part names, read from the wsdl port type
+    root = etree.parse(filename).getroot()
+    messages = {}
+    for message in root.iter(f"{{{WSDL_NS}}}message"):
+        messages[message.get("name")] = [part.get("name") for part in message.iter(f"{{{WSDL_NS}}}part")]
+
+    operations = {}
+    for operation in root.iter(f"{{{WSDL_NS}}}operation"):
+        message = operation.find(f"{{{WSDL_NS}}}input")
+        if message is None or message.get("message") is None:
+            continue
+        parts = messages[message.get("message").split(":")[-1]]
+        operations[operation.get("name")] = [part for part in parts if part != "authInfo"]
+    return operations
+
+
+class SyntheticRegion:
+    def __init__(
+            self,
+            stids: list[int] = (37,),
+            counties: int = 20,
+            systems: int = 2, # per county
+            sites: int = 4, # per system
+            talkgroups: int = 200, # per system
+            agencies: int = 3, # per county
+            subcats: int = 4, # per agency
+            freqs: int = 6, # per subcat
+            seed: int = 1
+    ):
+        self.sites_per_system = sites
+        self.talkgroups_per_system = talkgroups
+        self.freqs_per_subcat = freqs
+        self.seed = seed
+        r = random.Random(seed)
+
+        self.states = {}
+        self.counties = {}
+        self.system_ids = {} # sid -> stid
+        self.agency_infos = {}
+        self.subcat_ids = {} # scid -> (lat, lon)
+        sid = 1
+        aid = 1
+        scid = 1
+
+        def new_subcats(lat: float, lon: float, count: int):
+            nonlocal scid
+            result = []
+            for _ in range(count):
+                self.subcat_ids[scid] = (lat, lon)
+                result.append({
+                    "scid": scid,
+                    "scName": f"Subcat {scid}",
+                    "lat": f"{lat:.5f}",
+                    "lon": f"{lon:.5f}",
+                    "range": "15"
+                })
+                scid += 1
+            return result
+
+        for stid in stids:
+            lat0 = r.uniform(30, 45)
+            lon0 = r.uniform(-120, -75)
+            state_systems = []
+            state_agencies = []
+            county_list = []
+
+            for i in range(counties):
+                ctid = stid * 1000 + i + 1
+                lat = lat0 + r.uniform(-2, 2)
+                lon = lon0 + r.uniform(-2, 2)
+                county_list.append({"ctid": ctid, "countyName": f"County {ctid}", "countyHeader": ""})
+
+                trs_list = []
+                for _ in range(systems):
+                    # some systems are regional and listed under the previous county as well
+                    if trs_list and r.random() < 0.2:
+                        continue
+                    self.system_ids[sid] = (stid, lat, lon)
+                    trs_list.append(self.trs(sid, r.randrange(1, 28)))
+                    sid += 1
+                if i and r.random() < 0.2:
+                    previous = self.counties[ctid - 1]["trsList"]
+                    if previous:
+                        trs_list.append(previous[0])
+
+                agency_list = []
+                for _ in range(agencies):
+                    agency_list.append({"aid": aid, "aName": f"Agency {aid}", "aType": 1})
+                    self.agency_infos[aid] = {
+                        "aid": aid,
+                        "agencyName": f"Agency {aid}",
+                        "agencyType": "1",
+                        "ctid": ctid,
+                        "stid": stid,
+                        "lat": f"{lat:.5f}",
+                        "lon": f"{lon:.5f}",
+                        "range": "20",
+                        "lastUpdated": TIMESTAMP.format(r.randrange(1, 28)),
+                        "cats": [{"cid": aid, "cName": "Agency", "subcats": new_subcats(lat, lon, subcats)}]
+                    }
+                    aid += 1
+
+                self.counties[ctid] = {
+                    "ctid": ctid,
+                    "countyName": f"County {ctid}",
+                    "countyHeader": "",
+                    "stid": stid,
+                    "lat": f"{lat:.5f}",
+                    "lon": f"{lon:.5f}",
+                    "range": "30",
+                    "lastUpdated": TIMESTAMP.format(r.randrange(1, 28)),
+                    "cats": [{"cid": ctid, "cName": "County", "subcats": new_subcats(lat, lon, 1)}],
+                    "trsList": trs_list,
+                    "agencyList": agency_list
+                }
+
+            self.system_ids[sid] = (stid, lat0, lon0)
+            state_systems.append(self.trs(sid, 1))
+            sid += 1
+            for _ in range(2):
+                state_agencies.append({"aid": aid, "aName": f"State Agency {aid}", "aType": 2})
+                self.agency_infos[aid] = {
+                    "aid": aid,
+                    "agencyName": f"State Agency {aid}",
+                    "agencyType": "2",
+                    "ctid": 0,
+                    "stid": stid,
+                    "lat": f"{lat0:.5f}",
+                    "lon": f"{lon0:.5f}",
+                    "range": "100",
+                    "lastUpdated": TIMESTAMP.format(1),
+                    "cats": [{"cid": aid, "cName": "Statewide", "subcats": new_subcats(lat0, lon0, subcats)}]
+                }
+                aid += 1
+
+            self.states[stid] = {
+                "stid": stid,
+                "stateName": f"State {stid}",
+                "stateEntityType": "State",
+                "trsList": state_systems,
+                "agencyList": state_agencies,
+                "countyList": county_list
+            }
+
+    @staticmethod
+    def trs(sid: int, day: int):
+        return {"sid": sid, "sName": f"System {sid}", "sType": 8, "lastUpdated": TIMESTAMP.format(day)}
+
+    def stats(self):
+        return {
+            "states": len(self.states),
+            "counties": len(self.counties),
+            "systems": len(self.system_ids),
+            "talkgroups": len(self.system_ids) * self.talkgroups_per_system,
+            "agencies": len(self.agency_infos),
+            "subcats": len(self.subcat_ids),
+            "freqs": len(self.subcat_ids) * self.freqs_per_subcat
+        }
+
+    # system and subcat contents are generated on demand from their id, so large regions stay cheap
+    def random(self, kind: str, item_id: int):
+        return random.Random(f"{self.seed}:{kind}:{item_id}")
+
+    @lru_cache(maxsize=4096)
+    def system(self, sid: int):
+        stid, lat, lon = self.system_ids[sid]
+        r = self.random("system", sid)
+        details = {
+            "sName": f"System {sid}",
+            "sType": r.choice([8, 8, 8, 12, 11]),
+            "sFlavor": r.choice([20, 33]),
+            "sVoice": 1,
+            "sCity": "",
+            "lastUpdated": TIMESTAMP.format(r.randrange(1, 28))
+        }
+        sites = []
+        for k in range(self.sites_per_system):
+            sites.append({
+                "siteId": sid * 100 + k,
+                "sid": sid,
+                "siteNumber": k + 1,
+                "siteDescr": f"Site {sid}-{k + 1}",
+                "lat": f"{lat + r.uniform(-0.5, 0.5):.5f}",
+                "lon": f"{lon + r.uniform(-0.5, 0.5):.5f}",
+                "range": f"{r.uniform(5, 30):.1f}",
+                "siteFreqs": [
+                    {"lcn": n + 1, "freq": f"{r.uniform(851, 860):.5f}", "use": r.choice(["d", "a", None, None])}
+                    for n in range(r.randrange(3, 9))
+                ]
+            })
+        talkgroups = []
+        for t in range(self.talkgroups_per_system):
+            talkgroups.append({
+                "tgId": sid * 100000 + t,
+                "tgDec": t * 7 + 1,
+                "tgDescr": f"Talkgroup {t} & <{sid}>",
+                "tgAlpha": f"TG{t}",
+                "tgMode": "D",
+                "tags": [{"tagId": r.randrange(1, 38), "tagDescr": None}],
+                "tgCid": 1,
+                "tgSort": t
+            })
+        return details, sites, talkgroups
+
+    @lru_cache(maxsize=4096)
+    def freqs(self, scid: int):
+        lat, lon = self.subcat_ids[scid]
+        r = self.random("subcat", scid)
+        result = []
+        for n in range(self.freqs_per_subcat):
+            result.append({
+                "fid": scid * 1000 + n,
+                "out": f"{r.uniform(150, 470):.4f}",
+                "descr": f"Frequency {scid}-{n}",
+                "alpha": f"F{n}",
+                "tone": r.choice([None, "123.0 PL", "023 DPL", "CSQ"]),
+                "mode": str(r.choice([1, 1, 2, 3, 4, 6])),
+                "tags": [{"tagId": r.randrange(1, 38), "tagDescr": None}],
+                "scid": scid,
+                "sort": n,
+                "lastUpdated": TIMESTAMP.format(r.randrange(1, 28))
+            })
+        return result
+
+    def subcats_of(self, info: dict):
+        return [subcat["scid"] for cat in info["cats"] for subcat in cat["subcats"]]
+
+    # operations, named after the soap api
+    def getStateInfo(self, stid: int):
+        return self.states[stid]
+
+    def getCountyInfo(self, ctid: int):
+        return self.counties[ctid]
+
+    def getTrsDetails(self, sid: int):
+        return self.system(sid)[0]
+
+    def getTrsSites(self, sid: int):
+        return self.system(sid)[1]
+
+    def getTrsTalkgroups(self, sid: int, **_):
+        return self.system(sid)[2]
+
+    def getAgencyInfo(self, aid: int):
+        return self.agency_infos[aid]
+
+    def getSubcatFreqs(self, scid: int):
+        return self.freqs(scid)
+
+    def getCountiesByList(self, request: list):
+        return [
+            {"ctid": item["ctid"], "countyName": self.counties[item["ctid"]]["countyName"], "countyHeader": ""}
+            for item in request or [] if item["ctid"] in self.counties
+        ]
+
+    def getStatesByList(self, request: list):
+        return [
+            {"stid": item["stid"], "stateName": self.states[item["stid"]]["stateName"], "stateCode": ""}
+            for item in request or [] if item["stid"] in self.states
+        ]
+
+    def getAgencyFreqsByTag(self, aid: int, tag: int):
+        return [
+            freq for scid in self.subcats_of(self.agency_infos[aid]) for freq in self.freqs(scid)
+            if freq["tags"][0]["tagId"] == tag
+        ]
+
+    def getCountyFreqsByTag(self, ctid: int, tag: int):
+        return [
+            freq for scid in self.subcats_of(self.counties[ctid]) for freq in self.freqs(scid)
+            if freq["tags"][0]["tagId"] == tag
+        ]
+
+
+def parse_value(element):
+    # leaves become ints where possible, elements of leaves become dicts and anything deeper a list
+    if element is None or element.get(f"{{{XSI}}}nil") == "true":
+        return None
+    children = list(element)
+    if not children:
+        text = element.text or ""
+        try:
+            return int(text)
+        except ValueError:
+            return text
+    if all(len(child) for child in children):
+        return [parse_value(child) for child in children]
+    return {etree.QName(child).localname: parse_value(child) for child in children}
+
+
+def render_value(parent, name: str, value):
+    element = etree.SubElement(parent, name)
+    if value is None:
+        element.set(f"{{{XSI}}}nil", "true")
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            render_value(element, key, item)
+    elif isinstance(value, list):
+        for item in value:
+            render_value(element, "item", item)
+    else:
+        element.text = str(value)
+
+
+def envelope():
+    root = etree.Element(f"{{{SOAP_ENV}}}Envelope", nsmap={"SOAP-ENV": SOAP_ENV, "ns1": TNS, "xsi": XSI})
+    return root, etree.SubElement(root, f"{{{SOAP_ENV}}}Body")
+
+
+def response(operation: str, value):
+    root, body = envelope()
+    render_value(etree.SubElement(body, f"{{{TNS}}}{operation}Response"), "return", value)
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8")
+
+
+def fault(message: str, code: str = "Server"):
+    root, body = envelope()
+    element = etree.SubElement(body, f"{{{SOAP_ENV}}}Fault")
+    etree.SubElement(element, "faultcode").text = f"SOAP-ENV:{code}"
+    etree.SubElement(element, "faultstring").text = message
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8")
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes, with nagle on every keep-alive response
+    # would wait out the client's delayed ack
+    disable_nagle_algorithm = True
+    server: "MockServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status, content = self.server.handle_soap(body)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+            self,
+            region: SyntheticRegion,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            fault_rate: float = 0.0,
+            seed: int = 0
+    ):
+        super().__init__((host, port), MockHandler)
+        self.region = region
+        self.operations = load_operations()
+        self.latency = latency
+        self.jitter = jitter
+        self.fault_rate = fault_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.faults = Counter()
+        self.thread: threading.Thread | None = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/soap2/index.php"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.faults.clear()
+
+    def handle_soap(self, body: bytes):
+        try:
+            request = etree.fromstring(body).find(f"{{{SOAP_ENV}}}Body")[0]
+        except (etree.XMLSyntaxError, TypeError, IndexError):
+            return 400, fault("Malformed request", "Client")
+        operation = etree.QName(request).localname
+        if operation not in self.operations or not hasattr(self.region, operation):
+            return 500, fault(f"Unsupported operation {operation}", "Client")
+        kwargs = {part: parse_value(request.find(part)) for part in self.operations[operation]}
+
+        with self.lock:
+            self.calls[operation] += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            failed = self.random.random() < self.fault_rate
+            if failed:
+                self.faults[operation] += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return 500, fault("Server busy, try again later")
+
+        try:
+            value = getattr(self.region, operation)(**kwargs)
+        except KeyError as e:
+            return 500, fault(f"Invalid id {e}", "Client")
+        return 200, response(operation, value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic RadioReference SOAP api")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--states", default="37", help="comma separated state ids")
+    parser.add_argument("--counties", type=int, default=20)
+    parser.add_argument("--systems", type=int, default=2)
+    parser.add_argument("--sites", type=int, default=4)
+    parser.add_argument("--talkgroups", type=int, default=200)
+    parser.add_argument("--agencies", type=int, default=3)
+    parser.add_argument("--subcats", type=int, default=4)
+    parser.add_argument("--freqs", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    region = SyntheticRegion(
+        [int(stid) for stid in args.states.split(",")],
+        counties=args.counties,
+        systems=args.systems,
+        sites=args.sites,
+        talkgroups=args.talkgroups,
+        agencies=args.agencies,
+        subcats=args.subcats,
+        freqs=args.freqs
+    )
+    server = MockServer(
+        region,
+        args.host,
+        args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        fault_rate=args.fault_rate
+    )
+    print(f"Serving {region.stats()} at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from unittest import mock
+
+import gc
+import os
+import sys
+import tempfile
+import unittest
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from api import BinaryDatabase, Database, Modulation, Sites, System, Talkgroups # noqa
+from bench_pipeline import generate_database # noqa
+
+
+def make_database():
+    db = generate_database(systems=6, talkgroups=20, sites=3, agencies=12, freqs=4)
+    # records without talkgroups or sites and names outside ascii
+    db.systems.append(System("Système Ünicode 中", 999, Modulation.DMR, Talkgroups(), Sites(), "2024-01-01T00:00:00"))
+    return db
+
+
+class BinaryDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "db.bin")
+        self.db = make_database()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        for compress in (True, False):
+            with self.subTest(compress=compress):
+                self.db.to_binary(self.filename, compress=compress)
+                self.assertEqual(Database.from_binary(self.filename).serialize(), self.db.serialize())
+                with BinaryDatabase(self.filename) as binary:
+                    self.assertEqual(binary.compressed, compress)
+
+    def test_lookup_by_id(self):
+        self.db.to_binary(self.filename)
+        with mock.patch.object(BinaryDatabase, "decode_system", autospec=True, side_effect=BinaryDatabase.decode_system):
+            with BinaryDatabase(self.filename) as binary:
+                self.assertEqual(BinaryDatabase.decode_system.call_count, 0)
+                system = self.db.systems[3]
+                self.assertEqual(binary.system(system.system_id).serialize(), system.serialize())
+                # only the requested record is decoded
+                self.assertEqual(BinaryDatabase.decode_system.call_count, 1)
+                self.assertEqual(binary.system(999).name, "Système Ünicode 中")
+                self.assertIsNone(binary.system(12345))
+
+                agency = self.db.agencies[7]
+                self.assertEqual(binary.agency(agency.agency_id).serialize(), agency.serialize())
+                self.assertIsNone(binary.agency(12345))
+                self.assertEqual(len(binary.systems), len(self.db.systems))
+                self.assertEqual([system.system_id for system in binary.systems[-2:]], [6, 999])
+
+    def test_invalid_files_are_closed(self):
+        self.db.to_binary(self.filename)
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        for name, content in (("empty", b""), ("short", data[:10]), ("magic", b"XXXX" + data[4:])):
+            with self.subTest(name=name):
+                with open(self.filename, "wb") as f:
+                    f.write(content)
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter("always", ResourceWarning)
+                    with self.assertRaises(ValueError):
+                        BinaryDatabase(self.filename)
+                    gc.collect()
+                self.assertEqual([warning for warning in caught if warning.category is ResourceWarning], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+from unittest import mock
+
+import os
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import api # noqa
+from api import ( # noqa
+    Agencies,
+    Agency,
+    AgencyFreq,
+    AgencyFreqs,
+    Database,
+    Mode,
+    Modulation,
+    RadioReferenceAPI,
+    Site,
+    Sites,
+    System,
+    Systems,
+    Tag,
+    Talkgroup,
+    Talkgroups,
+    Tone,
+    ToneType
+)
+
+
+def make_agency(agency_id: int, names: list[str]):
+    freqs = AgencyFreqs(
+        AgencyFreq(name, Tone(ToneType.NONE, 0.0), 150 + agency_id + i / 100, Tag.FIRE_DISPATCH, Mode.FM)
+        for i, name in enumerate(names)
+    )
+    return Agency(agency_id, "County", f"Agency {agency_id}", freqs, 0, "2024-01-01T00:00:00")
+
+
+def make_database(agencies: list[Agency]):
+    talkgroups = Talkgroups(Talkgroup(tg_id, f"Talkgroup {tg_id}", Tag.FIRE_DISPATCH) for tg_id in range(1, 4))
+    sites = Sites([Site("Site 1", 1, [851.0125], [851.0125, 852.0125], 35.0, -80.0, 20.0)])
+    system = System("System 1", 1, Modulation.P25_P1, talkgroups, sites, "2024-01-01T00:00:00")
+    return Database(systems=Systems([system]), agencies=Agencies(agencies))
+
+
+class IncrementalExportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "playlist.xml")
+        self.cache = os.path.join(self.directory.name, "fragments.db")
+        self.agencies = [make_agency(1, ["Dispatch", "Tac 1", "Tac 2"]), make_agency(2, ["Dispatch", "Fire"])]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, agencies: list[Agency]):
+        return RadioReferenceAPI.export_sdrtrunk(make_database(agencies), self.filename, cache=self.cache)
+
+    def edit(self, func):
+        tree = ET.parse(self.filename)
+        for element in tree.getroot():
+            func(element)
+        tree.write(self.filename)
+
+    def elements(self, tag: str):
+        return [element for element in ET.parse(self.filename).getroot() if element.tag == tag]
+
+    def agency_alias(self, agency_id: int, name: str):
+        # agency aliases carry no agency id, find them through the channel written at the same position
+        aliases = [element for element in self.elements("alias") if element.get("list") == "Agencies"]
+        channels = [element for element in self.elements("channel") if element.get("system") == "County"]
+        for alias, channel in zip(aliases, channels):
+            if channel.get("site") == f"Agency {agency_id}" and channel.get("name") == name:
+                return alias
+        self.fail(f"no alias for {name} of agency {agency_id}")
+
+    def test_overrides_kept(self):
+        self.export(self.agencies)
+
+        def customize(element):
+            if element.get("name") == "Talkgroup 2":
+                element.set("color", "-16776961")
+                element.set("iconName", "Police")
+            elif element.tag == "channel" and element.get("name") == "Tac 1":
+                element.set("enabled", "true")
+        self.edit(customize)
+
+        self.agencies[1] = make_agency(2, ["Dispatch", "Fire", "EMS"])
+        self.export(self.agencies)
+        alias = [element for element in self.elements("alias") if element.get("name") == "Talkgroup 2"][0]
+        self.assertEqual(alias.get("color"), "-16776961")
+        self.assertEqual(alias.get("iconName"), "Police")
+        channel = [element for element in self.elements("channel") if element.get("name") == "Tac 1"][0]
+        self.assertEqual(channel.get("enabled"), "true")
+        self.assertEqual(len([element for element in self.elements("channel") if element.get("enabled") == "true"]), 1)
+
+    def test_extras_kept(self):
+        self.export(self.agencies)
+        root = ET.parse(self.filename).getroot()
+        ET.SubElement(root, "alias", {"color": "0", "list": "Mine", "name": "Scanner"})
+        ET.ElementTree(root).write(self.filename)
+
+        self.agencies.pop()
+        self.export(self.agencies)
+        extras = [element for element in self.elements("alias") if element.get("list") == "Mine"]
+        self.assertEqual([element.get("name") for element in extras], ["Scanner"])
+        self.assertNotIn("Agency 2", [element.get("site") for element in self.elements("channel")])
+
+    def test_agency_overrides_follow_renumbering(self):
+        self.export(self.agencies)
+        old_id = self.agency_alias(2, "Fire").find("id").get("value")
+        tree = ET.parse(self.filename)
+        aliases = [element for element in tree.getroot() if element.get("list") == "Agencies"]
+        aliases[[element.find("id").get("value") for element in aliases].index(old_id)].set("iconName", "Fire Truck")
+        tree.write(self.filename)
+
+        for names in (["Dispatch", "Tac 2"], ["Dispatch", "Tac 1", "Tac 2", "Tac 3", "Tac 4"]):
+            with self.subTest(names=names):
+                self.agencies[0] = make_agency(1, names)
+                self.export(self.agencies)
+                alias = self.agency_alias(2, "Fire")
+                self.assertEqual(alias.find("id").get("value"), str(len(names) + 2))
+                self.assertEqual(alias.get("iconName"), "Fire Truck")
+                icons = [element for element in self.elements("alias") if element.get("iconName") is not None]
+                self.assertEqual([element.find("id").get("value") for element in icons], [str(len(names) + 2)])
+
+    def test_unchanged_playlist_not_parsed(self):
+        self.export(self.agencies)
+        with mock.patch.object(api.ET, "parse", wraps=ET.parse) as parse:
+            writer = self.export(self.agencies)
+            self.assertEqual(parse.call_count, 0)
+            self.assertEqual(writer.stats(), {"rendered": 0, "reused": 3})
+
+            self.edit(lambda element: element.set("color", "1") if element.get("name") == "Talkgroup 1" else None)
+            parse.reset_mock()
+            self.export(self.agencies)
+            self.assertEqual(parse.call_count, 1)
+        alias = [element for element in self.elements("alias") if element.get("name") == "Talkgroup 1"][0]
+        self.assertEqual(alias.get("color"), "1")
+
+    def test_playlist_permissions(self):
+        umask = os.umask(0o022)
+        try:
+            self.export(self.agencies)
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o644)
+
+
+if __name__ == "__main__":
+    unittest.main()
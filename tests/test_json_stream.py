@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api import JSONStream # noqa
+
+# strings with escapes and json syntax inside them, numbers in every form and all three literals
+RECORDS = [
+    {"name": "Quote \" and \\\\ backslash", "tags": ["[not, an, array]", "{\"key\": 1}", "é中"]},
+    {"id": 123456789, "lat": -35.123456, "freq": 8.5125e2, "small": 1E-7, "zero": 0, "negative": -0.5},
+    {"flags": [True, False, None], "nested": {"empty": {}, "list": [], "text": ""}},
+    "bare string",
+    -42,
+    True,
+    None
+]
+
+
+def stream(text: str, chunk_size: int, **kwargs):
+    return JSONStream(io.StringIO(text), chunk_size, **kwargs)
+
+
+class JSONStreamTest(unittest.TestCase):
+    def test_chunk_boundaries(self):
+        for text in (json.dumps(RECORDS), json.dumps(RECORDS, indent=4)):
+            for chunk_size in range(1, 40):
+                with self.subTest(indent="\n" in text, chunk_size=chunk_size):
+                    self.assertEqual(list(stream(text, chunk_size).array()), RECORDS)
+
+    def test_numbers_split_across_chunks(self):
+        numbers = [1234567890123, -98765.4321, 6.02e23, 0.000001]
+        text = json.dumps(numbers).replace(" ", "")
+        for chunk_size in range(1, len(text) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(stream(text, chunk_size).array()), numbers)
+
+    def test_iter_file_key(self):
+        document = {"version": 1, "systems": RECORDS[:3], "meta": {"list": [1, [2, 3]]}, "agencies": RECORDS[3:]}
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "db.json")
+            with open(filename, "w") as f:
+                json.dump(document, f)
+            self.assertEqual(list(JSONStream.iter_file(filename, "systems")), RECORDS[:3])
+            self.assertEqual(list(JSONStream.iter_file(filename, "agencies")), RECORDS[3:])
+            self.assertEqual(list(JSONStream.iter_file(filename, "missing")), [])
+
+    def test_truncated(self):
+        text = json.dumps(RECORDS)
+        for end in range(len(text)):
+            with self.subTest(end=end):
+                with self.assertRaises(ValueError):
+                    list(stream(text[:end], 7).array())
+
+    def test_malformed(self):
+        for text in ('[1, 2 3]', '[{"a": 1,}]', '[tru]', '[1,]', '{"systems" [1]}', '[{"a": nul}]', '["x" "y"]', '1'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(stream(text, 4).array() if text[0] == "[" else stream(text, 4).object())
+
+    def test_value_size_bound(self):
+        f = io.StringIO('["' + "x" * 100000)
+        with self.assertRaisesRegex(ValueError, "longer than 1000"):
+            list(JSONStream(f, 16, max_value_size=1000).array())
+        # the stream gives up after reading about twice the bound, not at the end of the file
+        self.assertLess(f.tell(), 2100)
+
+        records = ["x" * 900, "y" * 900]
+        self.assertEqual(list(stream(json.dumps(records), 16, max_value_size=1000).array()), records)
+        with self.assertRaises(ValueError):
+            list(stream(json.dumps(["x" * 1200]), 16, max_value_size=1000).array())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+from datetime import date, time
+from decimal import Decimal
+from zeep import xsd
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from api import Database, ProgressHook, RadioReferenceAPI, ResponseCache # noqa
+from mock_server import MockServer, SyntheticRegion # noqa
+
+# every operation RadioReferenceAPI reads through the cache
+OPERATIONS = [
+    ("getStateInfo", {"stid": 37}),
+    ("getCountyInfo", {"ctid": 37001}),
+    ("getTrsDetails", {"sid": 1}),
+    ("getTrsSites", {"sid": 1}),
+    ("getTrsTalkgroups", {"sid": 1, "tgCid": xsd.Nil, "tgTag": xsd.Nil, "tgDec": xsd.Nil}),
+    ("getAgencyInfo", {"aid": 1}),
+    ("getSubcatFreqs", {"scid": 1}),
+    ("getCountiesByList", {"request": [{"ctid": 37001}, {"ctid": 37002}]}),
+    ("getStatesByList", {"request": [{"stid": 37}]}),
+    ("getAgencyFreqsByTag", {"aid": 1, "tag": 1}),
+    ("getCountyFreqsByTag", {"ctid": 37001, "tag": 1}),
+]
+
+
+class ResponseCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(SyntheticRegion([37], counties=3, talkgroups=10)).start()
+        cls.directory = tempfile.TemporaryDirectory()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.server.reset()
+        self.cache = ResponseCache(os.path.join(self.directory.name, f"{self.id()}.db"))
+        self.rrapi = self.make_api(self.cache)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def make_api(self, cache: ResponseCache | None):
+        return RadioReferenceAPI("user", "password", cache=cache, progress_hook=ProgressHook, address=self.server.url)
+
+    def assertSameResponse(self, fresh, cached, path: str = ""):
+        if fresh is None or isinstance(fresh, (bool, int, str)):
+            self.assertEqual(fresh, cached, path)
+        elif isinstance(fresh, Decimal):
+            self.assertEqual(float(fresh), cached, path)
+        elif isinstance(fresh, (date, time)):
+            self.assertEqual(fresh.isoformat(), cached, path)
+        elif isinstance(fresh, list):
+            self.assertEqual(len(fresh), len(cached), path)
+            for i, (fresh_item, cached_item) in enumerate(zip(fresh, cached)):
+                self.assertSameResponse(fresh_item, cached_item, f"{path}[{i}]")
+        else:
+            for name in fresh:
+                self.assertSameResponse(getattr(fresh, name), getattr(cached, name), f"{path}.{name}")
+
+    def test_round_trip(self):
+        for operation, kwargs in OPERATIONS:
+            with self.subTest(operation=operation):
+                fresh = self.rrapi._call(operation, **kwargs)
+                cached = self.rrapi._call(operation, **kwargs)
+                self.assertEqual(self.server.calls[operation], 1)
+                self.assertEqual(self.cache.hits[operation], 1)
+                self.assertSameResponse(fresh, cached)
+
+    def test_cached_crawl_matches(self):
+        expected = Database(self.make_api(None).get_all_systems(37), self.make_api(None).get_all_agencies(37))
+        self.rrapi.get_all_systems(37)
+        self.rrapi.get_all_agencies(37)
+
+        self.server.reset()
+        db = Database(self.rrapi.get_all_systems(37), self.rrapi.get_all_agencies(37))
+        self.assertEqual(sum(self.server.calls.values()), 0)
+        self.assertEqual(db.serialize(), expected.serialize())
+
+    def test_pickled_entries_are_misses(self):
+        key = ResponseCache.make_key("getTrsDetails", {"sid": 1})
+        self.cache.connection.execute(
+            "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (key, "getTrsDetails", b"\x80\x05N.", 4, 0, 0)
+        )
+        self.cache.size += 4
+        self.cache.ttls["getTrsDetails"] = float("inf")
+        self.assertIs(self.cache.get("getTrsDetails", {"sid": 1}), ResponseCache.MISS)
+        self.assertEqual(self.cache.size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()